@@ -0,0 +1,88 @@
+# benchmarks/analytics_engines.py
+"""
+Compare the SQLite and DuckDB analytics engines on the same queries.
+
+Seeds a throwaway SQLite database with synthetic parking usage and traffic
+readings, then times every analytics query on each available engine and
+prints one JSON object per (engine, query).
+
+Run from the backend directory:
+    python -m benchmarks.analytics_engines --rows 1000000
+"""
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+
+from benchmarks.seed import seed
+from services.analytics import SQLiteAnalytics, DuckDBAnalytics
+
+
+def time_query(fn, repeat: int) -> dict:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        "median_ms": round(statistics.median(timings), 2),
+        "min_ms": round(timings[0], 2),
+        "max_ms": round(timings[-1], 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1_000_000, help="parking_usage rows to seed")
+    parser.add_argument("--zones", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--days", type=int, default=3650, help="query window")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        started = time.perf_counter()
+        seed(path, args.rows, args.zones)
+        print(json.dumps({"event": "seeded", "rows": args.rows, "zones": args.zones,
+                          "seconds": round(time.perf_counter() - started, 2)}))
+
+        sa_engine = create_engine(f"sqlite:///{path}")
+        engines = [SQLiteAnalytics(sa_engine)]
+        try:
+            duck = DuckDBAnalytics(sa_engine)
+            started = time.perf_counter()
+            duck.sync()
+            print(json.dumps({"event": "duckdb_sync", "seconds": round(time.perf_counter() - started, 2)}))
+            engines.append(duck)
+        except ImportError:
+            print(json.dumps({"event": "skipped", "engine": "duckdb", "reason": "duckdb not installed"}))
+
+        since = datetime.now() - timedelta(days=args.days)
+        queries = {
+            "avg_occupancy": lambda e: e.avg_occupancy(since),
+            "avg_occupancy_excluding_anomalies": lambda e: e.avg_occupancy(since, True),
+            "heatmap": lambda e: e.occupancy_heatmap(since),
+            "aggregates_day": lambda e: e.occupancy_aggregates(since, "day"),
+            "aggregates_hour_one_zone": lambda e: e.occupancy_aggregates(since, "hour", 1),
+            "correlations": lambda e: e.occupancy_traffic_correlations(since),
+        }
+
+        for name, query in queries.items():
+            for analytics_engine in engines:
+                result = time_query(lambda: query(analytics_engine), args.repeat)
+                print(json.dumps(dict(
+                    {"engine": analytics_engine.name, "query": name, "rows": args.rows},
+                    **result
+                )))
+
+        sa_engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+# benchmarks/http_endpoints.py
+"""
+Load-test every API endpoint at fixed database sizes.
+
+For each size, seeds (or reuses) a SQLite database with that many
+parking_usage rows, then drives each endpoint at each concurrency level:
+
+  asgi     in a fresh process, through the ASGI app in-process (no network);
+           also counts SQL statements per request
+  uvicorn  against a local uvicorn server on a free port; SQL statements
+           are not counted (sql_statements_per_request is null), as they
+           are the same as in asgi mode and counting them in the server
+           would slow every request down
+
+Reused databases (--data-dir) are shifted to end at the current hour first,
+so time-windowed endpoints see the same data on every run.
+
+Prints one JSON object per (size, mode, endpoint, concurrency) with
+p50/p95/p99 latency, throughput and errors. With --baseline, results are
+compared with a previous --output file and any p95 slower than the baseline
+by more than --threshold is reported as a regression (exit status 1).
+
+Requires httpx. Run from the backend directory:
+    python -m benchmarks.http_endpoints --sizes 10000,1000000,10000000 --concurrency 1,8
+    python -m benchmarks.http_endpoints --output base.json
+    python -m benchmarks.http_endpoints --baseline base.json --threshold 0.2
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Zone/sensor ids and coordinates match benchmarks/seed.py
+LAT, LNG = -37.80, 144.97
+TILE_ZOOM = 14
+TILE_X = int((LNG + 180) / 360 * 2 ** TILE_ZOOM)
+TILE_Y = int((1 - math.asinh(math.tan(math.radians(LAT))) / math.pi) / 2 * 2 ** TILE_ZOOM)
+
+# name -> (method, path, json body)
+ENDPOINTS = {
+    "root": ("GET", "/", None),
+    "health": ("GET", "/health", None),
+    "trends_population": ("GET", "/api/trends/population", None),
+    "trends_congestion": ("GET", "/api/trends/congestion", None),
+    "trends_car_ownership": ("GET", "/api/trends/car-ownership", None),
+    "trends_combined": ("GET", "/api/trends/combined", None),
+    "parking_zones": ("GET", "/api/parking/zones", None),
+    "parking_zone": ("GET", "/api/parking/zones/1", None),
+    "parking_distribution": ("GET", "/api/parking/zones/1/distribution?days=365", None),
+    "parking_live": ("GET", "/api/parking/live?hours_back=24", None),
+    "parking_recommend": ("GET", f"/api/parking/recommend?lat={LAT}&lng={LNG}", None),
+    "environmental": ("GET", "/api/environmental", None),
+    "anomalies": ("GET", "/api/anomalies", None),
+    "changes": ("GET", "/api/changes?since=0&limit=1000", None),
+    "analytics_summary": ("GET", "/api/analytics/summary", None),
+    "analytics_heatmap": ("GET", "/api/analytics/heatmap?days=28", None),
+    "analytics_aggregates": ("GET", "/api/analytics/aggregates?granularity=day&days=30", None),
+    "analytics_correlations": ("GET", "/api/analytics/correlations?days=90", None),
+    "map_tile": ("GET", f"/api/map/tiles/{TILE_ZOOM}/{TILE_X}/{TILE_Y}", None),
+    "regions": ("GET", "/api/regions", None),
+    "regions_summary": ("GET", "/api/regions/summary", None),
+    "ingest_parking_usage": ("POST", "/api/parking/usage", {"zone_id": 1, "occupied_spaces": 50}),
+    "ingest_traffic_data": ("POST", "/api/traffic/data", {"sensor_id": 1, "vehicle_count": 120}),
+}
+
+
+def percentiles(latencies: List[float]) -> dict:
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (None,) * 3
+    return {
+        "p50_ms": None if p50 is None else round(float(p50), 2),
+        "p95_ms": None if p95 is None else round(float(p95), 2),
+        "p99_ms": None if p99 is None else round(float(p99), 2),
+    }
+
+
+async def drive(client: httpx.AsyncClient, method: str, path: str, body: Optional[dict],
+                requests: int, concurrency: int, warmup: int, max_seconds: float) -> dict:
+    """Send `requests` requests from `concurrency` workers, stopping early after max_seconds"""
+    for _ in range(warmup):
+        await client.request(method, path, json=body)
+
+    latencies: List[float] = []
+    errors = 0
+    issued = 0
+    deadline = time.perf_counter() + max_seconds
+
+    async def worker():
+        nonlocal issued, errors
+        while issued < requests and time.perf_counter() < deadline:
+            issued += 1
+            started = time.perf_counter()
+            try:
+                response = await client.request(method, path, json=body)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            latencies.append((time.perf_counter() - started) * 1000)
+            errors += not ok
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return dict(
+        percentiles(latencies),
+        requests=len(latencies),
+        errors=errors,
+        throughput_rps=round(len(latencies) / elapsed, 1) if elapsed else None
+    )
+
+
+async def run_endpoints(client: httpx.AsyncClient, args, statements=None) -> List[dict]:
+    results = []
+    for name, (method, path, body) in ENDPOINTS.items():
+        if args.endpoints and name not in args.endpoints:
+            continue
+        per_request = statements(client, method, path, body) if statements else None
+        if asyncio.iscoroutine(per_request):
+            per_request = await per_request
+        for concurrency in args.concurrency:
+            result = await drive(client, method, path, body, args.requests,
+                                 concurrency, args.warmup, args.max_seconds)
+            results.append(dict(
+                {"endpoint": name, "concurrency": concurrency, "sql_statements_per_request": per_request},
+                **result
+            ))
+    return results
+
+
+# In-process ASGI mode (runs in its own process so DATABASE_URL is read fresh)
+
+async def asgi_worker(args):
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    from database.query_log import query_source
+    from main import app
+
+    counted = [0]
+
+    def count_statement(*_):
+        if isinstance(query_source.get(), dict):  # Statements issued by a request
+            counted[0] += 1
+
+    event.listen(Engine, "after_cursor_execute", count_statement)
+
+    async def statements(client, method, path, body, samples=3):
+        counted[0] = 0
+        for _ in range(samples):
+            await client.request(method, path, json=body)
+        return round(counted[0] / samples, 1)
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            results = await run_endpoints(client, args, statements)
+
+    with open(args.result_file, "w") as f:
+        json.dump(results, f)
+
+
+def run_asgi(db_path: str, args) -> List[dict]:
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        result_file = f.name
+    try:
+        command = [
+            sys.executable, "-m", "benchmarks.http_endpoints", "--asgi-worker",
+            "--result-file", result_file,
+            "--requests", str(args.requests), "--warmup", str(args.warmup),
+            "--max-seconds", str(args.max_seconds),
+            "--concurrency", ",".join(map(str, args.concurrency)),
+        ]
+        if args.endpoints:
+            command += ["--endpoints", ",".join(args.endpoints)]
+        subprocess.run(command, cwd=BACKEND_DIR, env=app_env(db_path), stdout=sys.stderr, check=True)
+        with open(result_file) as f:
+            return json.load(f)
+    finally:
+        os.remove(result_file)
+
+
+# Local uvicorn mode
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_uvicorn(db_path: str, args) -> List[dict]:
+    port = free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=app_env(db_path), stdout=sys.stderr
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.time() + 60
+        while True:
+            try:
+                if httpx.get(f"{base_url}/health", timeout=1).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if server.poll() is not None or time.time() > deadline:
+                raise RuntimeError("uvicorn did not start")
+            time.sleep(0.2)
+
+        async def run():
+            limits = httpx.Limits(max_connections=max(args.concurrency))
+            async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+                return await run_endpoints(client, args)
+
+        return asyncio.run(run())
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def app_env(db_path: str) -> Dict[str, str]:
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}")
+    env.pop("REGION_DATABASES", None)  # Only the benchmark database
+    return env
+
+
+# Baseline comparison
+
+def result_key(result: dict) -> tuple:
+    return (result["rows"], result["mode"], result["endpoint"], result["concurrency"])
+
+
+def compare(results: List[dict], baseline: List[dict], threshold: float) -> List[dict]:
+    """Results whose p95 is more than `threshold` slower than the baseline's"""
+    previous = {result_key(r): r for r in baseline}
+    regressions = []
+    for result in results:
+        base = previous.get(result_key(result))
+        if not base or not base.get("p95_ms") or result.get("p95_ms") is None:
+            continue
+        change = result["p95_ms"] / base["p95_ms"] - 1
+        result["baseline_p95_ms"] = base["p95_ms"]
+        result["p95_change"] = round(change, 3)
+        if change > threshold:
+            regressions.append({
+                "rows": result["rows"], "mode": result["mode"], "endpoint": result["endpoint"],
+                "concurrency": result["concurrency"], "p95_ms": result["p95_ms"],
+                "baseline_p95_ms": base["p95_ms"], "change": round(change, 3)
+            })
+    return regressions
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int_list, default=[10_000, 1_000_000],
+                        help="comma-separated parking_usage row counts")
+    parser.add_argument("--zones", type=int, default=500)
+    parser.add_argument("--modes", default="asgi,uvicorn")
+    parser.add_argument("--concurrency", type=int_list, default=[1, 8])
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint and concurrency")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=10.0, help="time cap per endpoint and concurrency")
+    parser.add_argument("--endpoints", type=lambda v: v.split(","), help="comma-separated endpoint names")
+    parser.add_argument("--data-dir", help="keep seeded databases here and reuse them")
+    parser.add_argument("--output", help="write all results as one JSON document")
+    parser.add_argument("--baseline", help="previous --output file to compare with")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed p95 slowdown (0.10 = 10%%)")
+    parser.add_argument("--asgi-worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.asgi_worker:
+        asyncio.run(asgi_worker(args))
+        return
+
+    from benchmarks.seed import seed, seed_anchor, reanchor
+
+    runners = {"asgi": run_asgi, "uvicorn": run_uvicorn}
+    modes = [mode for mode in args.modes.split(",") if mode]
+    unknown = [mode for mode in modes if mode not in runners]
+    if unknown:
+        parser.error(f"unknown modes: {', '.join(unknown)}")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        data_dir = args.data_dir or tmp
+        os.makedirs(data_dir, exist_ok=True)
+        for rows in args.sizes:
+            db_path = os.path.join(data_dir, f"bench-{rows}-{args.zones}.db")
+            if os.path.exists(db_path) and seed_anchor(db_path) is None:
+                os.remove(db_path)  # Seeded before anchors were stored; can't be shifted
+            if os.path.exists(db_path):
+                hours = reanchor(db_path)
+                if hours:
+                    print(json.dumps({"event": "reanchored", "rows": rows, "hours": hours}), flush=True)
+            else:
+                started = time.perf_counter()
+                seed(db_path, rows, args.zones)
+                print(json.dumps({"event": "seeded", "rows": rows, "zones": args.zones,
+                                  "seconds": round(time.perf_counter() - started, 2)}), flush=True)
+
+            for mode in modes:
+                if mode == "uvicorn":
+                    print(json.dumps({"event": "note", "mode": mode,
+                                      "message": "sql_statements_per_request is only counted in asgi mode"}),
+                          flush=True)
+                # A copy per mode so ingest requests of one mode don't change the next one's data
+                run_path = os.path.join(tmp, f"run-{rows}-{mode}.db")
+                shutil.copyfile(db_path, run_path)
+                try:
+                    for result in runners[mode](run_path, args):
+                        result = dict({"rows": rows, "mode": mode}, **result)
+                        results.append(result)
+                        print(json.dumps(result), flush=True)
+                finally:
+                    os.remove(run_path)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold)
+        print(json.dumps({"event": "comparison", "baseline": args.baseline,
+                          "threshold": args.threshold, "regressions": regressions}), flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                "meta": {
+                    "created_at": datetime.now().isoformat(),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "zones": args.zones,
+                    "concurrency": args.concurrency,
+                    "requests": args.requests,
+                    "max_seconds": args.max_seconds,
+                    "sql_statements_counted_in": [mode for mode in modes if mode == "asgi"]
+                },
+                "results": results,
+                "regressions": regressions
+            }, f, indent=2)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
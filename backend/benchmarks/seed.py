@@ -0,0 +1,156 @@
+# benchmarks/seed.py
+"""
+Synthetic benchmark databases.
+
+`seed()` fills a fresh SQLite file with `rows` hourly parking usage
+readings spread over `zones` zones around the CBD, traffic readings for one
+sensor per ten zones, and the yearly trend and environmental reference
+data, using fixed random seeds so every run sees the same data.
+
+Readings end at the hour the database was seeded (its anchor, stored in the
+benchmark_seed table). `reanchor()` shifts a reused database's readings so
+they end at the current hour again, keeping the 24 hour and 28 day windows
+the endpoints query as full as on the day it was seeded.
+"""
+import contextlib
+import random
+import sqlite3
+import sys
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from database.models import Base
+from database.setup import (
+    populate_population_data, populate_congestion_data,
+    populate_car_ownership_data, populate_environmental_data
+)
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# Tables with hourly readings: (table, timestamp column)
+TIMESTAMPED_TABLES = (("parking_usage", "timestamp"), ("traffic_data", "timestamp"))
+
+
+def current_hour() -> datetime:
+    return datetime.now().replace(minute=0, second=0, microsecond=0)
+
+
+def seed_anchor(path: str) -> Optional[datetime]:
+    """The hour the database's newest readings are at, or None if it wasn't seeded by this module"""
+    conn = sqlite3.connect(path)
+    try:
+        row = conn.execute("SELECT anchor FROM benchmark_seed").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    finally:
+        conn.close()
+    return datetime.strptime(row[0], TIMESTAMP_FORMAT) if row else None
+
+
+def reanchor(path: str) -> int:
+    """Shift the readings of a seeded database to end at the current hour; returns the hours shifted"""
+    anchor = seed_anchor(path)
+    if anchor is None:
+        raise ValueError(f"{path} has no seed anchor; delete it to seed it again")
+    hours = int((current_hour() - anchor).total_seconds() // 3600)
+    if hours <= 0:
+        return 0
+
+    conn = sqlite3.connect(path)
+    try:
+        # The shift is not a data change; drop the change log entries its updates record
+        last_change = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+        for table, column in TIMESTAMPED_TABLES:
+            conn.execute(
+                f"UPDATE {table} SET "
+                f"{column} = strftime('%Y-%m-%d %H:%M:%S', {column}, '{hours:+d} hours') || '.000000', "
+                f"day_of_week = (day_of_week + (hour_of_day + ?) / 24) % 7, "
+                f"hour_of_day = (hour_of_day + ?) % 24",
+                (hours, hours)
+            )
+        conn.execute("DELETE FROM change_log WHERE seq > ?", (last_change,))
+        conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'change_log'", (last_change,))
+        conn.execute("UPDATE benchmark_seed SET anchor = ?",
+                     ((anchor + timedelta(hours=hours)).strftime(TIMESTAMP_FORMAT),))
+        conn.commit()
+    finally:
+        conn.close()
+    return hours
+
+
+def seed(path: str, rows: int, zones: int, seed_value: int = 42):
+    """Create the schema and fill it with `rows` hourly usage readings across `zones` zones"""
+    sa_engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(bind=sa_engine)
+    sa_engine.dispose()
+
+    rng = random.Random(seed_value)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO parking_zones (id, zone_name, zone_code, latitude, longitude, total_spaces, "
+        "hourly_rate, max_duration_hours, is_active) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)",
+        [
+            (i, f"Zone {i}", f"Z{i}", -37.81 + rng.random() / 50, 144.96 + rng.random() / 50,
+             100, 5 + rng.random() * 5, 4)
+            for i in range(1, zones + 1)
+        ]
+    )
+    conn.executemany(
+        "INSERT INTO traffic_sensors (id, sensor_id, location_name, is_active) VALUES (?, ?, ?, 1)",
+        [(i, f"S{i}", f"Sensor {i}") for i in range(1, zones // 10 + 2)]
+    )
+
+    end = current_hour()
+    conn.execute("CREATE TABLE benchmark_seed (anchor TEXT NOT NULL)")
+    conn.execute("INSERT INTO benchmark_seed (anchor) VALUES (?)", (end.strftime(TIMESTAMP_FORMAT),))
+    hours = rows // zones + 1
+
+    def usage_rows():
+        produced = 0
+        for h in range(hours):
+            ts = end - timedelta(hours=h)
+            stamp = ts.strftime(TIMESTAMP_FORMAT)
+            for zone_id in range(1, zones + 1):
+                if produced == rows:
+                    return
+                occupied = rng.randint(0, 100)
+                yield (zone_id, stamp, occupied, 100, float(occupied), ts.hour, ts.weekday())
+                produced += 1
+
+    conn.executemany(
+        "INSERT INTO parking_usage (zone_id, timestamp, occupied_spaces, total_spaces, "
+        "occupancy_rate, hour_of_day, day_of_week) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        usage_rows()
+    )
+
+    def traffic_rows():
+        for h in range(hours):
+            ts = end - timedelta(hours=h)
+            for sensor_id in range(1, zones // 10 + 2):
+                yield (sensor_id, ts.strftime(TIMESTAMP_FORMAT), rng.randint(0, 500),
+                       rng.uniform(5, 60), ts.hour, ts.weekday())
+
+    conn.executemany(
+        "INSERT INTO traffic_data (sensor_id, timestamp, vehicle_count, average_speed, "
+        "hour_of_day, day_of_week) VALUES (?, ?, ?, ?, ?, ?)",
+        traffic_rows()
+    )
+    conn.commit()
+    conn.close()
+
+    # Trend and environmental reference data, as database/setup.py loads it
+    sa_engine = create_engine(f"sqlite:///{path}")
+    db = sessionmaker(bind=sa_engine)()
+    random.seed(seed_value)
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            populate_population_data(db)
+            populate_congestion_data(db)
+            populate_car_ownership_data(db)
+            populate_environmental_data(db)
+    finally:
+        db.close()
+        sa_engine.dispose()
@@ -1,9 +1,16 @@
 # database/models.py
-from sqlalchemy import create_engine, Column, Integer, Float, String, DateTime, Boolean, Text, ForeignKey
+from sqlalchemy import (
+    create_engine, event, inspect, Column, Integer, Float, String, DateTime, Boolean, Text,
+    ForeignKey, LargeBinary, UniqueConstraint
+)
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.engine import Engine
 from sqlalchemy.orm import sessionmaker, relationship
 from datetime import datetime
 import os
+import time
+
+from database.query_log import slow_query_log
 
 # Database configuration
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./melbourne_parking.db")
@@ -134,6 +141,110 @@ class EnvironmentalData(Base):
     green_transport_percentage = Column(Float)  # % using public transport/cycling/walking
     created_at = Column(DateTime, default=datetime.utcnow)
 
+# Anomaly flags raised on ingested readings
+class AnomalyFlag(Base):
+    __tablename__ = "anomaly_flags"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String(20), nullable=False, index=True)  # parking_usage, traffic_data
+    reading_id = Column(Integer, nullable=False, index=True)  # Row id in the source table
+    entity_id = Column(Integer, nullable=False, index=True)  # Zone or sensor id
+    timestamp = Column(DateTime, nullable=False, index=True)  # Reading timestamp
+    metric = Column(String(30), nullable=False)  # occupancy_rate, vehicle_count, average_speed
+    value = Column(Float)
+    expected = Column(Float)
+    score = Column(Float)  # Deviation in standard deviations (outliers only)
+    reason = Column(String(20), nullable=False)  # invalid, stuck, jump, outlier
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+# Leases for background jobs that must run on one worker only
+class SchedulerLock(Base):
+    __tablename__ = "scheduler_locks"
+    
+    name = Column(String(50), primary_key=True)
+    owner = Column(String(100), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+# Occupancy histograms per zone and hour-of-week, rolled up per day, month and year
+class OccupancySketch(Base):
+    __tablename__ = "occupancy_sketches"
+    __table_args__ = (UniqueConstraint("zone_id", "level", "period_start"),)
+    
+    id = Column(Integer, primary_key=True, index=True)
+    zone_id = Column(Integer, ForeignKey("parking_zones.id"), nullable=False, index=True)
+    level = Column(String(5), nullable=False)  # day, month, year
+    period_start = Column(DateTime, nullable=False)  # Start of the day/month/year
+    count = Column(Integer, nullable=False)
+    bin_sum = Column(Integer, nullable=False)  # Sum of the readings' bin indexes, checked by verify()
+    cells = Column(LargeBinary, nullable=False)  # Sparse (hour_of_week uint8, bin uint8, count uint32)
+
+@event.listens_for(Base.metadata, "after_create")
+def replace_outdated_sketches(target, connection, **kw):
+    """Recreate the sketch table if it predates the day/month/year layout.
+
+    Sketches are derived from parking_usage, so the verify_occupancy_sketches
+    job rebuilds them on startup.
+    """
+    columns = {column["name"] for column in inspect(connection).get_columns(OccupancySketch.__tablename__)}
+    if not {"level", "bin_sum"} <= columns:
+        OccupancySketch.__table__.drop(connection)
+        OccupancySketch.__table__.create(connection)
+
+# Change sequence for delta sync, written by triggers on every tracked table
+class ChangeLog(Base):
+    __tablename__ = "change_log"
+    __table_args__ = {"sqlite_autoincrement": True}  # Never reuse sequence numbers
+
+    seq = Column(Integer, primary_key=True)
+    table_name = Column(String(50), nullable=False)
+    row_id = Column(Integer, nullable=False)
+    operation = Column(String(10), nullable=False)  # insert, update, delete
+    changed_at = Column(DateTime, nullable=False, index=True)  # UTC
+
+# Dialects the change log triggers are created on
+CHANGE_LOG_DIALECTS = ("sqlite",)
+
+# Tables whose writes are recorded in the change log
+CHANGE_TRACKED_TABLES = (
+    "population_trends", "congestion_trends", "car_ownership_trends",
+    "parking_zones", "parking_usage", "traffic_sensors", "traffic_data",
+    "environmental_data", "anomaly_flags"
+)
+
+@event.listens_for(Base.metadata, "after_create")
+def create_change_triggers(target, connection, **kw):
+    """Record inserts, updates and deletes on tracked tables in the change log.
+
+    Triggers catch every write, including bulk and raw SQL ones. They are
+    created idempotently so existing databases gain them on the next startup.
+    """
+    if connection.dialect.name not in CHANGE_LOG_DIALECTS:
+        return
+    for table in CHANGE_TRACKED_TABLES:
+        for operation, row in (("insert", "NEW"), ("update", "NEW"), ("delete", "OLD")):
+            connection.exec_driver_sql(
+                f"CREATE TRIGGER IF NOT EXISTS change_log_{table}_{operation} "
+                f"AFTER {operation.upper()} ON {table} BEGIN "
+                f"INSERT INTO change_log (table_name, row_id, operation, changed_at) "
+                f"VALUES ('{table}', {row}.id, '{operation}', strftime('%Y-%m-%d %H:%M:%f', 'now')); "
+                f"END"
+            )
+
+# Time every statement on every engine (shards included) for the slow-query log
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+@event.listens_for(Engine, "after_cursor_execute")
+def record_slow_query(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is None or not slow_query_log.enabled:
+        return
+    duration_ms = (time.perf_counter() - started) * 1000
+    if duration_ms >= slow_query_log.threshold_ms:
+        slow_query_log.record(conn, cursor, statement, parameters, executemany, duration_ms)
+
 # Create all tables
 def create_tables():
     """Create all database tables"""
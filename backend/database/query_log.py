@@ -0,0 +1,218 @@
+# database/query_log.py
+"""
+Slow-query log fed by the engine events in database/models.py.
+
+Every statement slower than SLOW_QUERY_MS is recorded with its normalized
+SQL (literals replaced by ?), the shape of its parameters, the driver's
+row count, its duration and the route or job that issued it, and printed
+as a JSON line. Statements are aggregated by fingerprint (a hash of the
+normalized SQL); the first slow run of each fingerprint, and every
+PLAN_REFRESH_SECONDS after that, captures EXPLAIN QUERY PLAN on SQLite.
+
+Durations cover execution up to the first row. SQLite finishes sorts and
+aggregates before returning a first row, so expensive plans are measured;
+time spent streaming rows to the caller is not. SQLite doesn't know a
+SELECT's row count at that point, so `rows` is only set for writes.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Dict, List, Optional, Union
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))  # Negative disables the log
+MAX_FINGERPRINTS = 500
+PLAN_REFRESH_SECONDS = 15 * 60
+
+# ASGI scope of the request being handled, or a label such as "job:<name>"
+query_source: ContextVar[Union[dict, str, None]] = ContextVar("query_source", default=None)
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(statement: str) -> str:
+    """Collapse whitespace and replace literals and IN lists with placeholders"""
+    sql = STRING_LITERAL.sub("?", statement)
+    sql = NUMBER_LITERAL.sub("?", sql)
+    sql = PLACEHOLDER_LIST.sub("(?+)", sql)
+    return WHITESPACE.sub(" ", sql).strip()
+
+
+def parameters_shape(parameters, executemany: bool):
+    """Parameter types without their values"""
+    if executemany:
+        batch = list(parameters or [])
+        return {"batch": len(batch), "row": parameters_shape(batch[0], False) if batch else None}
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    # Counted per type, like "IN (?+)" in the SQL, so long IN lists stay one small entry
+    return dict(Counter(type(value).__name__ for value in parameters or ()))
+
+
+def _route_label(source) -> str:
+    if source is None:
+        return "background"
+    if isinstance(source, str):
+        return source
+    endpoint = source.get("endpoint")
+    template = None
+    if endpoint is not None:
+        # Report the route template rather than the concrete path
+        for route in getattr(source.get("app"), "routes", ()):
+            if getattr(route, "endpoint", None) is endpoint:
+                template = route.path
+                break
+    return f"{source.get('method', '')} {template or source.get('path', '')}".strip()
+
+
+class QuerySourceMiddleware:
+    """ASGI middleware making the current request visible to the engine events"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = query_source.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            query_source.reset(token)
+
+
+class SlowQueryLog:
+    """Slow statements aggregated by normalized SQL fingerprint"""
+
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, max_fingerprints: int = MAX_FINGERPRINTS):
+        self.threshold_ms = threshold_ms
+        self.max_fingerprints = max_fingerprints
+        self.recorded = 0
+        self._lock = threading.Lock()
+        self._fingerprints: Dict[str, dict] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms >= 0
+
+    def _explain(self, dbapi_connection, statement: str, parameters) -> Optional[List[str]]:
+        """EXPLAIN QUERY PLAN on a separate cursor of the same connection"""
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ())
+            depth = {0: -1}
+            plan = []
+            for node_id, parent, _, detail in cursor.fetchall():
+                depth[node_id] = depth.get(parent, -1) + 1
+                plan.append("  " * depth[node_id] + detail)
+            return plan
+        except Exception as e:
+            return [f"EXPLAIN failed: {e}"]
+        finally:
+            cursor.close()
+
+    def record(self, conn, cursor, statement: str, parameters, executemany: bool, duration_ms: float):
+        """Record one slow statement; called from the after_cursor_execute event"""
+        sql = normalize_sql(statement)
+        fingerprint = hashlib.sha1(sql.encode()).hexdigest()[:12]
+        route = _route_label(query_source.get())
+        rows = cursor.rowcount if cursor.rowcount >= 0 else None
+        shape = parameters_shape(parameters, executemany)
+        now = time.time()
+
+        with self._lock:
+            entry = self._fingerprints.get(fingerprint)
+            needs_plan = entry is None or now - entry["plan_captured"] > PLAN_REFRESH_SECONDS
+
+        plan = None
+        if needs_plan and conn.dialect.name == "sqlite" and not executemany:
+            plan = self._explain(cursor.connection, statement, parameters)
+
+        with self._lock:
+            self.recorded += 1
+            entry = self._fingerprints.get(fingerprint)
+            if entry is None:
+                if len(self._fingerprints) >= self.max_fingerprints:
+                    cheapest = min(self._fingerprints, key=lambda f: self._fingerprints[f]["total_ms"])
+                    del self._fingerprints[cheapest]
+                entry = self._fingerprints[fingerprint] = {
+                    "fingerprint": fingerprint,
+                    "sql": sql,
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "routes": {},
+                    "plan": None,
+                    "plan_captured": 0.0
+                }
+            entry["count"] += 1
+            entry["total_ms"] += duration_ms
+            entry["max_ms"] = max(entry["max_ms"], duration_ms)
+            entry["routes"][route] = entry["routes"].get(route, 0) + 1
+            entry["last_seen"] = datetime.now().isoformat()
+            entry["last_rows"] = rows
+            entry["last_parameters"] = shape
+            if plan is not None:
+                entry["plan"] = plan
+                entry["plan_captured"] = now
+            plan = entry["plan"]
+
+        print(json.dumps({
+            "event": "slow_query",
+            "fingerprint": fingerprint,
+            "duration_ms": round(duration_ms, 2),
+            "route": route,
+            "rows": rows,
+            "parameters": shape,
+            "sql": sql,
+            "plan": plan
+        }, default=str), flush=True)
+
+    def top(self, limit: int = 20, order_by: str = "total_ms") -> List[dict]:
+        """Fingerprints with the most slow time (or count/max_ms), worst first"""
+        with self._lock:
+            entries = sorted(self._fingerprints.values(), key=lambda e: e[order_by], reverse=True)[:limit]
+            return [
+                dict(
+                    {k: v for k, v in entry.items() if k != "plan_captured"},
+                    total_ms=round(entry["total_ms"], 2),
+                    max_ms=round(entry["max_ms"], 2),
+                    avg_ms=round(entry["total_ms"] / entry["count"], 2),
+                    routes=dict(entry["routes"])
+                )
+                for entry in entries
+            ]
+
+    def summary(self, limit: int = 10) -> dict:
+        return {
+            "threshold_ms": self.threshold_ms,
+            "recorded": self.recorded,
+            "fingerprints": len(self._fingerprints),
+            "top": self.top(limit)
+        }
+
+    def log_summary(self, limit: int = 10):
+        """Print the top fingerprints as one JSON line"""
+        if self._fingerprints:
+            summary = self.summary(limit)
+            for entry in summary["top"]:
+                entry.pop("plan", None)
+            print(json.dumps(dict(summary, event="slow_query_summary"), default=str), flush=True)
+
+    def reset(self):
+        with self._lock:
+            self._fingerprints.clear()
+            self.recorded = 0
+
+
+# Process-wide log shared by every shard engine
+slow_query_log = SlowQueryLog()
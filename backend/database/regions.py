@@ -0,0 +1,148 @@
+# database/regions.py
+"""
+Region (city/precinct) sharding: one database per region.
+
+The default region uses DATABASE_URL. Extra regions come from
+REGION_DATABASES, a comma-separated list of region=url pairs, e.g.
+
+    REGION_DATABASES="sydney-cbd=sqlite:///./sydney_parking.db,geelong=sqlite:///./geelong.db"
+
+Each shard has the full schema, so adding a region only means adding a
+database; existing shards are untouched. The region of the current request
+lives in a context variable (set by the /api/regions/{region}/... routing
+middleware) and `get_db()` opens a session on that region's shard.
+Per-region in-memory services (caches, detectors) are held in RegionLocal.
+"""
+import os
+import re
+import threading
+from contextvars import ContextVar
+from typing import Callable, Dict, Generic, List, Optional, TypeVar
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from database.models import Base, DATABASE_URL, engine, SessionLocal
+
+T = TypeVar("T")
+
+DEFAULT_REGION = os.getenv("DEFAULT_REGION", "melbourne-cbd")
+REGION_DATABASES = os.getenv("REGION_DATABASES", "")
+REGION_NAME = re.compile(r"^[a-z0-9][a-z0-9-]*$")
+
+# Region of the request/job being handled
+current_region: ContextVar[str] = ContextVar("current_region", default=DEFAULT_REGION)
+
+
+class UnknownRegion(KeyError):
+    """Raised when a region has no configured shard"""
+
+
+class Shard:
+    """Engine and session factory for one region's database"""
+
+    def __init__(self, region: str, url: str, shard_engine=None, session_factory=None):
+        self.region = region
+        self.url = url
+        self.engine = shard_engine or create_engine(
+            url,
+            connect_args={"check_same_thread": False} if "sqlite" in url else {}
+        )
+        self.SessionLocal = session_factory or sessionmaker(
+            autocommit=False, autoflush=False, bind=self.engine
+        )
+
+    def create_tables(self):
+        Base.metadata.create_all(bind=self.engine)
+
+
+def parse_region_databases(value: str) -> Dict[str, str]:
+    """Parse "region=url,region=url" into a dict"""
+    regions = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        region, sep, url = item.partition("=")
+        region = region.strip()
+        if not sep or not REGION_NAME.match(region):
+            raise ValueError(f"Invalid REGION_DATABASES entry: {item!r}")
+        regions[region] = url.strip()
+    return regions
+
+
+class ShardRouter:
+    """Maps region names to shards"""
+
+    def __init__(self):
+        self._shards: Dict[str, Shard] = {
+            DEFAULT_REGION: Shard(DEFAULT_REGION, DATABASE_URL, engine, SessionLocal)
+        }
+        for region, url in parse_region_databases(REGION_DATABASES).items():
+            self.add_region(region, url)
+
+    def __contains__(self, region: str) -> bool:
+        return region in self._shards
+
+    def regions(self) -> List[str]:
+        return list(self._shards)
+
+    def shard(self, region: Optional[str] = None) -> Shard:
+        """Shard for a region (the current region by default)"""
+        region = region or current_region.get()
+        try:
+            return self._shards[region]
+        except KeyError:
+            raise UnknownRegion(region)
+
+    def add_region(self, region: str, url: str) -> Shard:
+        if not REGION_NAME.match(region):
+            raise ValueError(f"Invalid region name: {region!r}")
+        shard = self._shards[region] = Shard(region, url)
+        return shard
+
+    def create_tables(self):
+        """Create missing tables on every shard"""
+        for shard in self._shards.values():
+            shard.create_tables()
+
+
+class RegionLocal(Generic[T]):
+    """Lazily created per-region instances of an in-memory service"""
+
+    def __init__(self, factory: Callable[[Shard], T]):
+        self._factory = factory
+        self._instances: Dict[str, T] = {}
+        self._lock = threading.Lock()
+
+    def get(self, region: Optional[str] = None) -> T:
+        """Instance for a region (the current region by default)"""
+        region = region or current_region.get()
+        instance = self._instances.get(region)
+        if instance is None:
+            with self._lock:
+                instance = self._instances.get(region)
+                if instance is None:
+                    instance = self._instances[region] = self._factory(router.shard(region))
+        return instance
+
+
+def run_in_region(region: str, fn: Callable[[Session], T]) -> T:
+    """Call fn(db) with a session on the region's shard and the region as current"""
+    token = current_region.set(region)
+    db = router.shard(region).SessionLocal()
+    try:
+        return fn(db)
+    finally:
+        db.close()
+        current_region.reset(token)
+
+
+def get_db():
+    """Get database session for the current region"""
+    db = router.shard().SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+# Shared router used by the API and background jobs
+router = ShardRouter()
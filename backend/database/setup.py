@@ -1,13 +1,14 @@
 # database/setup.py
 from sqlalchemy.orm import Session
 from database.models import (
-    create_tables, get_db, engine, SessionLocal,
     PopulationTrend, CongestionTrend, CarOwnershipTrend,
     ParkingZone, ParkingUsage, TrafficSensor, TrafficData,
     EnvironmentalData
 )
+from database.regions import router, DEFAULT_REGION
 from datetime import datetime, timedelta
 import random
+import sys
 
 
 MELBOURNE_POPULATION_DATA = [
@@ -34,10 +35,10 @@ MELBOURNE_POPULATION_DATA = [
     {"year": 2021, "population": 153655}
 ]
 
-def setup_database():
-    """Initialize database and create all tables"""
-    print("Creating database tables...")
-    create_tables()
+def setup_database(region: str = DEFAULT_REGION):
+    """Initialize a region's database and create all tables"""
+    print(f"Creating database tables for {region}...")
+    router.shard(region).create_tables()
     print(" Database tables created successfully!")
 
 def populate_population_data(db: Session):
@@ -234,8 +235,14 @@ def populate_environmental_data(db: Session):
     db.commit()
     print("Environmental data populated!")
 
-def main():
+def main(region: str = DEFAULT_REGION):
     """Main setup function"""
+    # Sample data is Melbourne CBD's; other regions start with empty tables
+    if region != DEFAULT_REGION:
+        setup_database(region)
+        print(f"Region {region} ready at {router.shard(region).url}")
+        return
+    
     print("Setting up Melbourne CBD Parking Database...")
     print("=" * 50)
     
@@ -243,7 +250,7 @@ def main():
     setup_database()
     
     # Create database session
-    db = SessionLocal()
+    db = router.shard().SessionLocal()
     
     try:
         # Populate all data
@@ -278,4 +285,4 @@ def main():
         db.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(*sys.argv[1:2])
\ No newline at end of file
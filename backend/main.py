@@ -1,25 +1,69 @@
 # main.py - Updated FastAPI with Database
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Request, Response, Query
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func as db_func
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+import json
 
 
 # Import database models and dependencies
 from database.models import (
-    get_db, PopulationTrend, CongestionTrend, CarOwnershipTrend,
-    ParkingZone, ParkingUsage, EnvironmentalData
+    PopulationTrend, CongestionTrend, CarOwnershipTrend,
+    ParkingZone, ParkingUsage, EnvironmentalData, TrafficSensor, AnomalyFlag
 )
+from database.regions import get_db, router, DEFAULT_REGION
+from database.query_log import QuerySourceMiddleware, slow_query_log
+from services.map_tiles import tile_caches, MAX_ZOOM
+from services.recommendations import recommendation_engines
+from services.anomalies import exclude_flagged
+from services.ingest import ingest_parking_usage, ingest_traffic_data
+from services.concurrency import coalesced
+from services.scheduler import scheduler
+from services.jobs import register_jobs
+from services.admin import require_admin
+from services.analytics import analytics_engines, GRANULARITIES
+from services.timeseries import occupancy_stores
+from services.regions import RegionRoutingMiddleware, fan_out
+from services.changes import (
+    get_changes, current_cursor, validate_tables, CursorExpired, ChangeFeedUnavailable
+)
+from services.profiling import ProfilingMiddleware, profile_store, to_collapsed
+from services.sketches import distribution
+
+# Startup/shutdown: ensure database is initialized and run background jobs
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Initialize database on startup and run the job scheduler while the app is up"""
+    try:
+        router.create_tables()
+        print(f"Database tables verified/created on startup for regions: {', '.join(router.regions())}")
+    except Exception as e:
+        print(f"Database startup error: {e}")
+    
+    register_jobs(scheduler)
+    await scheduler.start()
+    try:
+        yield
+    finally:
+        await scheduler.stop()
 
 # Create FastAPI app instance
 app = FastAPI(
     title="Melbourne CBD Parking System API",
     description="API for Melbourne CBD parking system with real database integration",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
+# Attribute SQL statements to routes in the slow-query log (innermost, sees the routed scope)
+app.add_middleware(QuerySourceMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -36,6 +80,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Serve /api/regions/{region}/... from the region's shard
+app.add_middleware(RegionRoutingMiddleware)
+
+# Profile requests sent with X-Profile: 1 (admin) or picked by PROFILE_SAMPLE_RATE
+app.add_middleware(ProfilingMiddleware)
+
 # Pydantic models for API responses
 class TrendData(BaseModel):
     year: str
@@ -64,7 +114,58 @@ class ParkingUsageData(BaseModel):
     zone_name: str
     occupied_spaces: int
     total_spaces: int
-    occupancy_rate: float
+    occupancy_rate: Optional[float] = None  # Null when the reading had no capacity
+
+class ParkingRecommendation(BaseModel):
+    zone_id: int
+    zone_name: str
+    zone_code: str
+    latitude: float
+    longitude: float
+    walking_distance_m: int
+    walking_minutes: float
+    expected_free_spaces: float
+    total_spaces: int
+    hourly_rate: float
+    total_cost: float
+    max_duration_hours: Optional[int] = None
+    score: float
+
+class RecommendationResponse(BaseModel):
+    arrival: datetime
+    duration_hours: float
+    recommendations: List[ParkingRecommendation]
+
+class ParkingUsageCreate(BaseModel):
+    zone_id: int
+    timestamp: Optional[datetime] = None
+    occupied_spaces: int = Field(ge=0)
+    total_spaces: Optional[int] = Field(None, gt=0)  # Defaults to the zone's capacity
+
+class TrafficDataCreate(BaseModel):
+    sensor_id: int
+    timestamp: Optional[datetime] = None
+    vehicle_count: Optional[int] = None
+    average_speed: Optional[float] = None
+    congestion_level: Optional[str] = None
+
+class AnomalyInfo(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    source: str
+    reading_id: int
+    entity_id: int
+    timestamp: datetime
+    metric: str
+    value: Optional[float] = None
+    expected: Optional[float] = None
+    score: Optional[float] = None
+    reason: str
+
+class IngestResponse(BaseModel):
+    id: int
+    anomalies: List[AnomalyInfo]
 
 class EnvironmentalMetrics(BaseModel):
     year: int
@@ -87,7 +188,19 @@ async def root():
             "combined_trends": "/api/trends/combined",
             "parking_zones": "/api/parking/zones",
             "live_parking": "/api/parking/live",
+            "parking_recommendations": "/api/parking/recommend",
+            "zone_distribution": "/api/parking/zones/{zone_id}/distribution",
+            "map_tiles": "/api/map/tiles/{z}/{x}/{y}",
             "environmental": "/api/environmental",
+            "analytics_summary": "/api/analytics/summary",
+            "occupancy_heatmap": "/api/analytics/heatmap",
+            "occupancy_aggregates": "/api/analytics/aggregates",
+            "occupancy_correlations": "/api/analytics/correlations",
+            "anomalies": "/api/anomalies",
+            "changes": "/api/changes",
+            "regions": "/api/regions",
+            "regions_summary": "/api/regions/summary",
+            "region_scoped": "/api/regions/{region}/...",
             "api_docs": "/docs"
         }
     }
@@ -227,8 +340,12 @@ async def get_combined_trends(db: Session = Depends(get_db)):
 
 # Parking zones endpoint
 @app.get("/api/parking/zones", response_model=List[ParkingZoneInfo])
-async def get_parking_zones(db: Session = Depends(get_db)):
+async def get_parking_zones():
     """Get all parking zones with current occupancy"""
+    return await coalesced("parking_zones", (), load_parking_zones)
+
+def load_parking_zones(db: Session) -> List[ParkingZoneInfo]:
+    """Query all active zones with their latest occupancy"""
     try:
         zones = db.query(ParkingZone).filter(ParkingZone.is_active == True).all()
         
@@ -261,18 +378,42 @@ async def get_parking_zones(db: Session = Depends(get_db)):
 @app.get("/api/parking/live", response_model=List[ParkingUsageData])
 async def get_live_parking_data(
     hours_back: int = 24,
-    db: Session = Depends(get_db)
+    exclude_anomalies: bool = False
 ):
     """Get recent parking usage data"""
+    return await coalesced(
+        "parking_live", (hours_back, exclude_anomalies),
+        lambda db: load_live_parking_data(db, hours_back, exclude_anomalies)
+    )
+
+def load_live_parking_data(
+    db: Session,
+    hours_back: int,
+    exclude_anomalies: bool
+) -> List[ParkingUsageData]:
+    """Query the latest usage rows within the window"""
     try:
         cutoff_time = datetime.now() - timedelta(hours=hours_back)
         
+        # Served from the in-memory occupancy store when it covers the window
+        occupancy_store = occupancy_stores.get()
+        if occupancy_store.covers(cutoff_time):
+            return [
+                ParkingUsageData(**row)
+                for row in occupancy_store.latest(cutoff_time, 100, exclude_anomalies)
+            ]
+        
         # Query recent usage data with zone information
-        results = db.query(ParkingUsage, ParkingZone).join(
+        query = db.query(ParkingUsage, ParkingZone).join(
             ParkingZone, ParkingUsage.zone_id == ParkingZone.id
         ).filter(
             ParkingUsage.timestamp >= cutoff_time
-        ).order_by(ParkingUsage.timestamp.desc()).limit(100).all()
+        )
+        
+        if exclude_anomalies:
+            query = exclude_flagged(query, "parking_usage")
+        
+        results = query.order_by(ParkingUsage.timestamp.desc()).limit(100).all()
         
         usage_data = [
             ParkingUsageData(
@@ -324,6 +465,24 @@ async def get_environmental_data(
 @app.get("/api/parking/zones/{zone_id}")
 async def get_parking_zone(zone_id: int, db: Session = Depends(get_db)):
     """Get specific parking zone details"""
+    # Served from the in-memory occupancy store when it holds the zone
+    occupancy_store = occupancy_stores.get()
+    zone_info = occupancy_store.zone(zone_id)
+    recent = occupancy_store.recent(zone_id, 24)
+    if zone_info is not None and recent is not None:
+        return {
+            "zone_info": {
+                "id": zone_info["id"],
+                "name": zone_info["zone_name"],
+                "code": zone_info["zone_code"],
+                "location": {"lat": zone_info["latitude"], "lng": zone_info["longitude"]},
+                "total_spaces": zone_info["total_spaces"],
+                "hourly_rate": zone_info["hourly_rate"],
+                "max_duration_hours": zone_info["max_duration_hours"]
+            },
+            "recent_usage": recent
+        }
+    
     zone = db.query(ParkingZone).filter(ParkingZone.id == zone_id).first()
     
     if not zone:
@@ -354,10 +513,176 @@ async def get_parking_zone(zone_id: int, db: Session = Depends(get_db)):
         ]
     }
 
+# Zone occupancy distribution endpoint
+@app.get("/api/parking/zones/{zone_id}/distribution")
+async def get_zone_distribution(
+    zone_id: int,
+    days: int = Query(28, ge=1, le=3650),
+    db: Session = Depends(get_db)
+):
+    """Get p50/p90/p99 occupancy and the share of time over 95% full, overall and per hour of week"""
+    zone = db.query(ParkingZone).filter(ParkingZone.id == zone_id).first()
+    
+    if not zone:
+        raise HTTPException(status_code=404, detail="Parking zone not found")
+    
+    try:
+        since = (datetime.now() - timedelta(days=days)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return dict(
+            {"zone_id": zone.id, "zone_name": zone.zone_name, "days": days, "since": since},
+            **distribution(db, zone.id, since)
+        )
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+# Parking recommendation endpoint
+@app.get("/api/parking/recommend", response_model=RecommendationResponse)
+def recommend_parking(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    arrival: Optional[datetime] = None,
+    duration_hours: float = Query(1.0, gt=0, le=24),
+    max_walk_m: float = Query(1000.0, gt=0, le=5000),
+    limit: int = Query(5, ge=1, le=50),
+    db: Session = Depends(get_db)
+):
+    """Rank zones by expected free spaces at arrival, walking distance and total cost"""
+    arrival = arrival or datetime.now()
+    try:
+        recommendations = recommendation_engines.get().recommend(
+            db, lat, lng, arrival, duration_hours, max_walk_m, limit
+        )
+
+        return RecommendationResponse(
+            arrival=arrival,
+            duration_hours=duration_hours,
+            recommendations=[ParkingRecommendation(**r) for r in recommendations]
+        )
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Recommendation error: {str(e)}")
+
+# Parking usage ingestion endpoint
+@app.post("/api/parking/usage", response_model=IngestResponse, status_code=201)
+def create_parking_usage(reading: ParkingUsageCreate, db: Session = Depends(get_db)):
+    """Record a parking occupancy reading and flag it if anomalous"""
+    zone = db.query(ParkingZone).filter(ParkingZone.id == reading.zone_id).first()
+    
+    if not zone:
+        raise HTTPException(status_code=404, detail="Parking zone not found")
+    
+    if reading.total_spaces is None and not zone.total_spaces:
+        raise HTTPException(status_code=422, detail="Parking zone has no capacity; total_spaces is required")
+    
+    try:
+        usage, flags = ingest_parking_usage(
+            db, zone,
+            timestamp=reading.timestamp or datetime.now(),
+            occupied_spaces=reading.occupied_spaces,
+            total_spaces=reading.total_spaces
+        )
+        
+        return IngestResponse(
+            id=usage.id,
+            anomalies=[AnomalyInfo.model_validate(flag) for flag in flags]
+        )
+        
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+# Traffic data ingestion endpoint
+@app.post("/api/traffic/data", response_model=IngestResponse, status_code=201)
+def create_traffic_data(reading: TrafficDataCreate, db: Session = Depends(get_db)):
+    """Record a traffic sensor reading and flag it if anomalous"""
+    sensor = db.query(TrafficSensor).filter(TrafficSensor.id == reading.sensor_id).first()
+    
+    if not sensor:
+        raise HTTPException(status_code=404, detail="Traffic sensor not found")
+    
+    try:
+        data, flags = ingest_traffic_data(
+            db, sensor,
+            timestamp=reading.timestamp or datetime.now(),
+            vehicle_count=reading.vehicle_count,
+            average_speed=reading.average_speed,
+            congestion_level=reading.congestion_level
+        )
+        
+        return IngestResponse(
+            id=data.id,
+            anomalies=[AnomalyInfo.model_validate(flag) for flag in flags]
+        )
+        
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+# Anomalies endpoint
+@app.get("/api/anomalies", response_model=List[AnomalyInfo])
+async def get_anomalies(
+    since: Optional[datetime] = None,
+    source: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    """Get flagged readings, newest first, optionally since a reading timestamp"""
+    try:
+        query = db.query(AnomalyFlag)
+        
+        if since:
+            query = query.filter(AnomalyFlag.timestamp >= since)
+        if source:
+            query = query.filter(AnomalyFlag.source == source)
+        
+        flags = query.order_by(AnomalyFlag.timestamp.desc()).limit(limit).all()
+        
+        return [AnomalyInfo.model_validate(flag) for flag in flags]
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+# Change feed endpoint
+@app.get("/api/changes")
+async def get_change_feed(
+    since: Optional[int] = Query(None, ge=0),
+    tables: Optional[str] = None,
+    limit: int = Query(1000, ge=1, le=10000),
+    db: Session = Depends(get_db)
+):
+    """Get rows inserted, updated or deleted since a cursor, plus the next cursor.
+    
+    Without `since`, returns the current cursor to start syncing from after a full load.
+    """
+    try:
+        table_names = validate_tables(tables)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        if since is None:
+            return {"since": None, "cursor": current_cursor(db), "has_more": False, "changes": {}}
+        return get_changes(db, since, table_names, limit)
+        
+    except CursorExpired as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    except ChangeFeedUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
 # Analytics endpoint for dashboard
 @app.get("/api/analytics/summary")
-async def get_analytics_summary(db: Session = Depends(get_db)):
+async def get_analytics_summary(exclude_anomalies: bool = False):
     """Get summary analytics for dashboard"""
+    return await coalesced(
+        "analytics_summary", (exclude_anomalies,),
+        lambda db: load_analytics_summary(db, exclude_anomalies)
+    )
+
+def load_analytics_summary(db: Session, exclude_anomalies: bool) -> dict:
+    """Query the dashboard summary figures"""
     try:
         # Get latest population data
         latest_population = db.query(PopulationTrend).order_by(
@@ -374,11 +699,12 @@ async def get_analytics_summary(db: Session = Depends(get_db)):
         
         # Get average occupancy from last 24 hours
         cutoff_time = datetime.now() - timedelta(hours=24)
-        avg_occupancy = db.query(ParkingUsage).filter(
-            ParkingUsage.timestamp >= cutoff_time
-        ).with_entities(
-            db.func.avg(ParkingUsage.occupancy_rate)
-        ).scalar()
+        occupancy_store = occupancy_stores.get()
+        analytics = analytics_engines.get()
+        if occupancy_store.covers(cutoff_time):
+            avg_occupancy = occupancy_store.average(cutoff_time, exclude_anomalies)
+        else:
+            avg_occupancy = analytics.avg_occupancy(cutoff_time, exclude_anomalies)
         
         return {
             "population": {
@@ -393,12 +719,169 @@ async def get_analytics_summary(db: Session = Depends(get_db)):
                 "total_zones": total_zones,
                 "avg_occupancy_24h": round(avg_occupancy, 1) if avg_occupancy else None
             },
+            "analytics_engine": analytics.name,
             "last_updated": datetime.now().isoformat()
         }
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Analytics error: {str(e)}")
 
+# Occupancy heatmap endpoint
+@app.get("/api/analytics/heatmap")
+async def get_occupancy_heatmap(
+    days: int = Query(28, ge=1, le=3650),
+    exclude_anomalies: bool = False
+):
+    """Get average occupancy per zone, day of week and hour of day"""
+    def load(db: Session):
+        try:
+            analytics = analytics_engines.get()
+            since = datetime.now() - timedelta(days=days)
+            return {
+                "engine": analytics.name,
+                "days": days,
+                "cells": analytics.occupancy_heatmap(since, exclude_anomalies)
+            }
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Analytics error: {str(e)}")
+    
+    return await coalesced("analytics_queries", ("heatmap", days, exclude_anomalies), load)
+
+# Occupancy aggregates endpoint
+@app.get("/api/analytics/aggregates")
+async def get_occupancy_aggregates(
+    granularity: str = "day",
+    days: int = Query(30, ge=1, le=3650),
+    zone_id: Optional[int] = None,
+    exclude_anomalies: bool = False
+):
+    """Get average/min/max occupancy per zone per hour or day"""
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=400, detail=f"granularity must be one of {', '.join(GRANULARITIES)}")
+    
+    def load(db: Session):
+        try:
+            analytics = analytics_engines.get()
+            since = datetime.now() - timedelta(days=days)
+            return {
+                "engine": analytics.name,
+                "granularity": granularity,
+                "days": days,
+                "data": analytics.occupancy_aggregates(since, granularity, zone_id, exclude_anomalies)
+            }
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Analytics error: {str(e)}")
+    
+    return await coalesced(
+        "analytics_queries", ("aggregates", granularity, days, zone_id, exclude_anomalies), load
+    )
+
+# Occupancy/traffic correlations endpoint
+@app.get("/api/analytics/correlations")
+async def get_occupancy_correlations(
+    days: int = Query(90, ge=1, le=3650),
+    exclude_anomalies: bool = False
+):
+    """Correlate hour-of-week parking occupancy with traffic volume and speed"""
+    def load(db: Session):
+        try:
+            analytics = analytics_engines.get()
+            since = datetime.now() - timedelta(days=days)
+            return dict(
+                analytics.occupancy_traffic_correlations(since, exclude_anomalies),
+                engine=analytics.name,
+                days=days
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Analytics error: {str(e)}")
+    
+    return await coalesced("analytics_queries", ("correlations", days, exclude_anomalies), load)
+
+# Regions endpoint
+@app.get("/api/regions")
+async def get_regions():
+    """List the regions served, each under /api/regions/{region}/..."""
+    return {
+        "default": DEFAULT_REGION,
+        "regions": [
+            {"region": region, "prefix": f"/api/regions/{region}"}
+            for region in router.regions()
+        ]
+    }
+
+# Cross-region summary endpoint
+@app.get("/api/regions/summary")
+async def get_regions_summary(exclude_anomalies: bool = False):
+    """Summarize parking across every region, queried concurrently"""
+    def load(db: Session) -> dict:
+        cutoff_time = datetime.now() - timedelta(hours=24)
+        total_zones = db.query(ParkingZone).filter(ParkingZone.is_active == True).count()
+        query = db.query(
+            db_func.sum(ParkingUsage.occupancy_rate), db_func.count(ParkingUsage.occupancy_rate)
+        ).filter(ParkingUsage.timestamp >= cutoff_time)
+        if exclude_anomalies:
+            query = exclude_flagged(query, "parking_usage")
+        occupancy_sum, occupancy_count = query.one()
+        latest_population = db.query(PopulationTrend).order_by(
+            PopulationTrend.year.desc()
+        ).first()
+        return {
+            "total_zones": total_zones,
+            "occupancy_sum": occupancy_sum or 0.0,
+            "occupancy_count": occupancy_count,
+            "population": latest_population.population if latest_population else None
+        }
+
+    results = await fan_out(load)
+
+    regions, errors = {}, {}
+    for region, result in results.items():
+        if isinstance(result, Exception):
+            errors[region] = str(result)
+            continue
+        regions[region] = {
+            "total_zones": result["total_zones"],
+            "avg_occupancy_24h": round(result["occupancy_sum"] / result["occupancy_count"], 1)
+            if result["occupancy_count"] else None,
+            "population": result["population"]
+        }
+
+    # Weighted by readings, not an average of region averages
+    occupancy_sum = sum(r["occupancy_sum"] for r in results.values() if not isinstance(r, Exception))
+    occupancy_count = sum(r["occupancy_count"] for r in results.values() if not isinstance(r, Exception))
+
+    return {
+        "total_zones": sum(r["total_zones"] for r in regions.values()),
+        "avg_occupancy_24h": round(occupancy_sum / occupancy_count, 1) if occupancy_count else None,
+        "regions": regions,
+        "errors": errors,
+        "last_updated": datetime.now().isoformat()
+    }
+
+# Map tiles endpoint
+@app.get("/api/map/tiles/{z}/{x}/{y}")
+async def get_map_tile(
+    z: int,
+    x: int,
+    y: int,
+    request: Request,
+    db: Session = Depends(get_db)
+):
+    """Get a clustered GeoJSON tile of parking zones and traffic sensors"""
+    if not 0 <= z <= MAX_ZOOM or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+        raise HTTPException(status_code=404, detail="Tile not found")
+
+    try:
+        etag, body = await run_in_threadpool(tile_caches.get().get_tile, db, z, x, y)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Map tile error: {str(e)}")
+
+    headers = {"ETag": f'"{etag}"', "Cache-Control": "public, max-age=30"}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=body, media_type="application/geo+json", headers=headers)
+
 # Health check with database status
 @app.get("/health")
 async def health_check(db: Session = Depends(get_db)):
@@ -428,17 +911,64 @@ async def health_check(db: Session = Depends(get_db)):
             "timestamp": datetime.now().isoformat()
         }
 
-# Startup event to ensure database is initialized
-@app.on_event("startup")
-async def startup_event():
-    """Initialize database on startup"""
+# In-memory occupancy store status
+@app.get("/admin/timeseries", dependencies=[Depends(require_admin)])
+async def get_timeseries_status(verify: bool = False, db: Session = Depends(get_db)):
+    """Get occupancy store memory usage, optionally verified against the database"""
+    occupancy_store = occupancy_stores.get()
+    status = occupancy_store.stats()
+    if verify:
+        status["verification"] = occupancy_store.verify(db)
+    return status
+
+# Background jobs status
+@app.get("/admin/jobs", dependencies=[Depends(require_admin)])
+async def get_jobs_status():
+    """Get background job status: last run, duration, lag and failures"""
+    return scheduler.status()
+
+# Request profile captures
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """List captured request profiles, newest first"""
+    return {"profiles": await run_in_threadpool(profile_store.list)}
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: str, format: str = "speedscope"):
+    """Download a profile as speedscope JSON or collapsed stacks"""
+    if format not in ("speedscope", "collapsed"):
+        raise HTTPException(status_code=400, detail="format must be one of speedscope, collapsed")
+    
     try:
-        # Import and run database setup
-        from database.models import create_tables
-        create_tables()
-        print("Database tables verified/created on startup")
-    except Exception as e:
-        print(f"Database startup error: {e}")
+        profile = await run_in_threadpool(profile_store.load, profile_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    
+    if format == "collapsed":
+        return PlainTextResponse(to_collapsed(profile))
+    return Response(
+        content=json.dumps(profile),
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="{profile_id}.speedscope.json"'}
+    )
+
+# Slow-query log
+@app.get("/admin/slow-queries", dependencies=[Depends(require_admin)])
+async def get_slow_queries(
+    limit: int = Query(20, ge=1, le=500),
+    order_by: str = "total_ms"
+):
+    """Get the slowest query fingerprints with their routes and query plans"""
+    if order_by not in ("total_ms", "max_ms", "count"):
+        raise HTTPException(status_code=400, detail="order_by must be one of total_ms, max_ms, count")
+    
+    return dict(slow_query_log.summary(0), top=slow_query_log.top(limit, order_by))
+
+@app.delete("/admin/slow-queries", dependencies=[Depends(require_admin)])
+async def reset_slow_queries():
+    """Clear the slow-query log"""
+    slow_query_log.reset()
+    return {"status": "cleared"}
 
 if __name__ == "__main__":
     import uvicorn
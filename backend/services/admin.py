@@ -0,0 +1,30 @@
+# services/admin.py
+"""
+Access control for /admin endpoints.
+
+Admin requests must send X-Admin-Token matching ADMIN_TOKEN. Without a
+configured token every admin request is rejected, unless ADMIN_OPEN=1
+explicitly opens them (local development only).
+"""
+import os
+import secrets
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+ADMIN_OPEN = os.getenv("ADMIN_OPEN", "0") == "1"
+
+
+def is_admin(token: Optional[str]) -> bool:
+    """True if the token matches the configured admin token (always, with ADMIN_OPEN=1 and no token)"""
+    if not ADMIN_TOKEN:
+        return ADMIN_OPEN
+    return bool(token and secrets.compare_digest(token, ADMIN_TOKEN))
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Dependency rejecting requests without the configured admin token"""
+    if not is_admin(x_admin_token):
+        detail = "Admin token required" if ADMIN_TOKEN else "Admin endpoints are disabled (set ADMIN_TOKEN)"
+        raise HTTPException(status_code=403, detail=detail)
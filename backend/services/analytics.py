@@ -0,0 +1,374 @@
+# services/analytics.py
+"""
+Analytical query engines for GROUP BY-heavy endpoints.
+
+ANALYTICS_ENGINE selects where aggregate queries run:
+- "sqlite" (default): directly on the application database.
+- "duckdb": on an embedded DuckDB database holding columnar copies of the
+  reading tables, stored per region at ANALYTICS_DUCKDB_PATH (a path
+  template with a {region} placeholder; ":memory:" keeps the copy in RAM).
+  A background job syncs it incrementally from SQLite: rows with an id
+  above the last synced id are appended, and rows updated or deleted since
+  the last sync (per change_log) are re-copied or dropped. Until the first
+  sync of the process finishes, queries run on SQLite. Requires
+  `pip install duckdb`; without it the SQLite engine is used.
+
+A DuckDB file can only be opened by one process at a time; with several
+workers, the ones that cannot open it query SQLite.
+
+Point lookups and writes always stay on SQLite. Both engines run the same
+SQL; only timestamp bucketing and parameter style differ.
+"""
+import math
+import os
+import re
+import threading
+from datetime import datetime
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy import bindparam, func, select, text
+from sqlalchemy.engine import Engine
+
+from database.models import engine as default_engine, ChangeLog
+from database.regions import RegionLocal, DEFAULT_REGION
+
+ANALYTICS_ENGINE = os.getenv("ANALYTICS_ENGINE", "sqlite").lower()
+ANALYTICS_DUCKDB_PATH = os.getenv("ANALYTICS_DUCKDB_PATH", "./analytics_{region}.duckdb")
+SYNC_BATCH_ROWS = 100_000
+RECONCILE_CHUNK = 500  # Stay under SQLite's bound parameter limit
+
+GRANULARITIES = ("hour", "day")
+
+# ":name" bind parameters (not "::" casts or "%H:00" formats), rewritten to "$name" for DuckDB
+PARAM_PATTERN = re.compile(r"(?<!:):([A-Za-z_]\w*)")
+
+EXCLUDE_FLAGGED_USAGE = (
+    "AND id NOT IN (SELECT reading_id FROM anomaly_flags WHERE source = 'parking_usage')"
+)
+
+AVG_OCCUPANCY_SQL = """
+    SELECT AVG(occupancy_rate) FROM parking_usage
+    WHERE timestamp >= :since {exclude}
+"""
+
+HEATMAP_SQL = """
+    SELECT zone_id, day_of_week, hour_of_day, AVG(occupancy_rate), COUNT(*)
+    FROM parking_usage
+    WHERE timestamp >= :since {exclude}
+    GROUP BY zone_id, day_of_week, hour_of_day
+    ORDER BY zone_id, day_of_week, hour_of_day
+"""
+
+AGGREGATES_SQL = """
+    SELECT zone_id, {bucket} AS bucket, AVG(occupancy_rate), MIN(occupancy_rate),
+           MAX(occupancy_rate), COUNT(*)
+    FROM parking_usage
+    WHERE timestamp >= :since {zone_filter} {exclude}
+    GROUP BY zone_id, bucket
+    ORDER BY zone_id, bucket
+"""
+
+HOURLY_PROFILE_SQL = """
+    WITH parking AS (
+        SELECT day_of_week, hour_of_day, AVG(occupancy_rate) AS occupancy
+        FROM parking_usage
+        WHERE timestamp >= :since {exclude}
+        GROUP BY day_of_week, hour_of_day
+    ), traffic AS (
+        SELECT day_of_week, hour_of_day, AVG(vehicle_count) AS vehicles,
+               AVG(average_speed) AS speed
+        FROM traffic_data
+        WHERE timestamp >= :since
+        GROUP BY day_of_week, hour_of_day
+    )
+    SELECT parking.day_of_week, parking.hour_of_day, occupancy, vehicles, speed
+    FROM parking JOIN traffic
+      ON parking.day_of_week = traffic.day_of_week AND parking.hour_of_day = traffic.hour_of_day
+"""
+
+
+def pearson(xs: List[Optional[float]], ys: List[Optional[float]]) -> Optional[float]:
+    """Pearson correlation over pairs where both values are present"""
+    pairs = [(x, y) for x, y in zip(xs, ys) if x is not None and y is not None]
+    if len(pairs) < 3:
+        return None
+    x = np.array([p[0] for p in pairs], dtype=np.float64)
+    y = np.array([p[1] for p in pairs], dtype=np.float64)
+    if x.std() == 0 or y.std() == 0:
+        return None
+    r = float(np.corrcoef(x, y)[0, 1])
+    return None if math.isnan(r) else round(r, 4)
+
+
+class AnalyticsEngine:
+    """Aggregate queries shared by both engines"""
+
+    name = "base"
+
+    def _fetch(self, sql: str, params: dict) -> list:
+        raise NotImplementedError
+
+    def _bucket(self, granularity: str) -> str:
+        raise NotImplementedError
+
+    def _active(self) -> "AnalyticsEngine":
+        """Engine that answers queries right now"""
+        return self
+
+    def sync(self):
+        """Bring the engine up to date with SQLite (no-op when querying SQLite directly)"""
+
+    def avg_occupancy(self, since: datetime, exclude_anomalies: bool = False) -> Optional[float]:
+        sql = AVG_OCCUPANCY_SQL.format(exclude=EXCLUDE_FLAGGED_USAGE if exclude_anomalies else "")
+        return self._active()._fetch(sql, {"since": since})[0][0]
+
+    def occupancy_heatmap(self, since: datetime, exclude_anomalies: bool = False) -> List[dict]:
+        sql = HEATMAP_SQL.format(exclude=EXCLUDE_FLAGGED_USAGE if exclude_anomalies else "")
+        return [
+            {
+                "zone_id": zone_id,
+                "day_of_week": day_of_week,
+                "hour_of_day": hour_of_day,
+                "avg_occupancy": round(avg, 1) if avg is not None else None,
+                "samples": samples
+            }
+            for zone_id, day_of_week, hour_of_day, avg, samples in self._active()._fetch(sql, {"since": since})
+        ]
+
+    def occupancy_aggregates(
+        self,
+        since: datetime,
+        granularity: str = "day",
+        zone_id: Optional[int] = None,
+        exclude_anomalies: bool = False
+    ) -> List[dict]:
+        engine = self._active()
+        params = {"since": since}
+        if zone_id is not None:
+            params["zone_id"] = zone_id
+        sql = AGGREGATES_SQL.format(
+            bucket=engine._bucket(granularity),
+            zone_filter="AND zone_id = :zone_id" if zone_id is not None else "",
+            exclude=EXCLUDE_FLAGGED_USAGE if exclude_anomalies else ""
+        )
+        return [
+            {
+                "zone_id": row_zone,
+                "bucket": bucket,
+                "avg_occupancy": round(avg, 1) if avg is not None else None,
+                "min_occupancy": low,
+                "max_occupancy": high,
+                "samples": samples
+            }
+            for row_zone, bucket, avg, low, high, samples in engine._fetch(sql, params)
+        ]
+
+    def occupancy_traffic_correlations(self, since: datetime, exclude_anomalies: bool = False) -> dict:
+        sql = HOURLY_PROFILE_SQL.format(exclude=EXCLUDE_FLAGGED_USAGE if exclude_anomalies else "")
+        rows = self._active()._fetch(sql, {"since": since})
+        occupancy = [row[2] for row in rows]
+        return {
+            "hour_of_week_buckets": len(rows),
+            "occupancy_vs_vehicle_count": pearson(occupancy, [row[3] for row in rows]),
+            "occupancy_vs_average_speed": pearson(occupancy, [row[4] for row in rows])
+        }
+
+
+class SQLiteAnalytics(AnalyticsEngine):
+    """Runs aggregates on the application database"""
+
+    name = "sqlite"
+
+    def __init__(self, sa_engine: Engine = default_engine):
+        self.sa_engine = sa_engine
+
+    def _fetch(self, sql: str, params: dict) -> list:
+        # SQLite stores DateTime as text; compare against the same format
+        params = {
+            k: v.strftime("%Y-%m-%d %H:%M:%S.%f") if isinstance(v, datetime) else v
+            for k, v in params.items()
+        }
+        with self.sa_engine.connect() as conn:
+            return conn.execute(text(sql), params).fetchall()
+
+    def _bucket(self, granularity: str) -> str:
+        fmt = "%Y-%m-%d %H:00" if granularity == "hour" else "%Y-%m-%d"
+        return f"strftime('{fmt}', timestamp)"
+
+
+class DuckDBAnalytics(AnalyticsEngine):
+    """Runs aggregates on columnar DuckDB copies of the reading tables"""
+
+    name = "duckdb"
+
+    # Mirrored tables: name -> (column, DuckDB type, NumPy dtype)
+    TABLES = {
+        "parking_usage": [
+            ("id", "BIGINT", np.int64),
+            ("zone_id", "BIGINT", np.int64),
+            ("timestamp", "TIMESTAMP", "datetime64[us]"),
+            ("occupancy_rate", "DOUBLE", np.float64),
+            ("hour_of_day", "INTEGER", np.float64),
+            ("day_of_week", "INTEGER", np.float64),
+        ],
+        "traffic_data": [
+            ("id", "BIGINT", np.int64),
+            ("sensor_id", "BIGINT", np.int64),
+            ("timestamp", "TIMESTAMP", "datetime64[us]"),
+            ("vehicle_count", "DOUBLE", np.float64),
+            ("average_speed", "DOUBLE", np.float64),
+            ("hour_of_day", "INTEGER", np.float64),
+            ("day_of_week", "INTEGER", np.float64),
+        ],
+    }
+
+    def __init__(self, sa_engine: Engine = default_engine, path: str = ":memory:"):
+        import duckdb
+
+        self.sa_engine = sa_engine
+        self.path = path
+        self._conn = duckdb.connect(path)
+        self._fallback = SQLiteAnalytics(sa_engine)
+        self._sync_lock = threading.Lock()
+        self._synced = False
+        self._last_ids = {}
+
+        for table, columns in self.TABLES.items():
+            ddl = ", ".join(f"{name} {sql_type}" for name, sql_type, _ in columns)
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({ddl})")
+            self._last_ids[table] = self._conn.execute(f"SELECT MAX(id) FROM {table}").fetchone()[0] or 0
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS anomaly_flags (source VARCHAR, reading_id BIGINT)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sync_state (name VARCHAR PRIMARY KEY, value BIGINT)")
+        state = self._conn.execute("SELECT value FROM sync_state WHERE name = 'change_log_seq'").fetchone()
+        self._last_seq: Optional[int] = state[0] if state else None  # None: never synced
+
+    def _active(self) -> AnalyticsEngine:
+        # The copy may be missing or stale until this process has synced it once
+        return self if self._synced else self._fallback
+
+    def _insert_rows(self, table: str, rows: list):
+        batch = {}
+        for (name, _, dtype), values in zip(self.TABLES[table], zip(*rows)):
+            if dtype == np.float64:
+                values = [np.nan if v is None else v for v in values]
+            batch[name] = np.array(values, dtype=dtype)
+        self._conn.register("batch", batch)
+        self._conn.execute(f"INSERT INTO {table} SELECT * FROM batch")
+        self._conn.unregister("batch")
+
+    def _select_sql(self, table: str, where: str) -> str:
+        return f"SELECT {', '.join(name for name, _, _ in self.TABLES[table])} FROM {table} WHERE {where}"
+
+    def _copy_new_rows(self, table: str):
+        select_sql = text(self._select_sql(table, "id > :last_id") + f" ORDER BY id LIMIT {SYNC_BATCH_ROWS}")
+        while True:
+            with self.sa_engine.connect() as conn:
+                rows = conn.execute(select_sql, {"last_id": self._last_ids[table]}).fetchall()
+            if not rows:
+                return
+            self._insert_rows(table, rows)
+            self._last_ids[table] = rows[-1][0]
+            if len(rows) < SYNC_BATCH_ROWS:
+                return
+
+    def _save_seq(self, seq: int):
+        self._conn.execute("INSERT OR REPLACE INTO sync_state VALUES ('change_log_seq', ?)", [seq])
+        self._last_seq = seq
+
+    def _reconcile_changes(self):
+        """Re-copy or drop already-copied rows that changed since the last sync"""
+        if self.sa_engine.dialect.name != "sqlite":
+            return  # change_log is only written on SQLite; readings are treated as append-only
+
+        with self.sa_engine.connect() as conn:
+            oldest, newest = conn.execute(select(func.min(ChangeLog.seq), func.max(ChangeLog.seq))).one()
+            oldest, newest = oldest or 0, newest or 0
+            if self._last_seq is None or self._last_seq > newest or (oldest and self._last_seq < oldest - 1):
+                # Never synced, a different database, or changes since the last sync were pruned:
+                # copy everything afresh
+                for table in self.TABLES:
+                    self._conn.execute(f"DELETE FROM {table}")
+                    self._last_ids[table] = 0
+                self._save_seq(newest)
+                return
+
+            changed = conn.execute(
+                select(ChangeLog.table_name, ChangeLog.row_id).where(
+                    ChangeLog.seq > self._last_seq, ChangeLog.seq <= newest,
+                    ChangeLog.table_name.in_(list(self.TABLES))
+                ).distinct()
+            ).all()
+
+            for table in self.TABLES:
+                # Rows above the last copied id are picked up by _copy_new_rows
+                row_ids = sorted({row_id for name, row_id in changed
+                                  if name == table and row_id <= self._last_ids[table]})
+                for start in range(0, len(row_ids), RECONCILE_CHUNK):
+                    chunk = row_ids[start:start + RECONCILE_CHUNK]
+                    placeholders = ", ".join("?" * len(chunk))
+                    self._conn.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", chunk)
+                    rows = conn.execute(
+                        text(self._select_sql(table, "id IN :ids")).bindparams(bindparam("ids", expanding=True)),
+                        {"ids": chunk}
+                    ).fetchall()
+                    if rows:
+                        self._insert_rows(table, rows)
+        self._save_seq(newest)
+
+    def sync(self):
+        """Apply changed rows, append new readings and replace the (small, prunable) anomaly flag set"""
+        with self._sync_lock:
+            self._reconcile_changes()
+            for table in self.TABLES:
+                self._copy_new_rows(table)
+
+            with self.sa_engine.connect() as conn:
+                flags = conn.execute(text("SELECT source, reading_id FROM anomaly_flags")).fetchall()
+            self._conn.execute("DELETE FROM anomaly_flags")
+            if flags:
+                self._conn.executemany("INSERT INTO anomaly_flags VALUES (?, ?)", flags)
+            self._synced = True
+
+    def _fetch(self, sql: str, params: dict) -> list:
+        # Each thread gets its own cursor; the connection itself isn't thread-safe
+        cursor = self._conn.cursor()
+        try:
+            return cursor.execute(PARAM_PATTERN.sub(r"$\1", sql), params).fetchall()
+        finally:
+            cursor.close()
+
+    def _bucket(self, granularity: str) -> str:
+        fmt = "%Y-%m-%d %H:00" if granularity == "hour" else "%Y-%m-%d"
+        return f"strftime(timestamp, '{fmt}')"
+
+
+def create_analytics_engine(
+    name: str = ANALYTICS_ENGINE,
+    sa_engine: Engine = default_engine,
+    region: str = DEFAULT_REGION
+) -> AnalyticsEngine:
+    """Create the configured engine, falling back to SQLite if DuckDB is unavailable"""
+    if name == "duckdb":
+        try:
+            import duckdb
+        except ImportError:
+            print("ANALYTICS_ENGINE=duckdb but duckdb is not installed; using SQLite")
+        else:
+            path = ANALYTICS_DUCKDB_PATH.format(region=region)
+            try:
+                return DuckDBAnalytics(sa_engine, path)
+            except duckdb.IOException as e:
+                # Typically the file is held by another worker process
+                print(f"Cannot open DuckDB copy {path} ({e}); using SQLite")
+    elif name != "sqlite":
+        print(f"Unknown ANALYTICS_ENGINE {name!r}; using SQLite")
+    return SQLiteAnalytics(sa_engine)
+
+
+# Per-region engines used by the API
+analytics_engines = RegionLocal(
+    lambda shard: create_analytics_engine(sa_engine=shard.engine, region=shard.region)
+)
@@ -0,0 +1,259 @@
+# services/anomalies.py
+"""
+Online anomaly detection for parking occupancy and traffic readings.
+
+Each (source, entity, metric) keeps running mean/variance per hour-of-week
+bucket (168 buckets). Updates are O(1): the first STATS_WINDOW samples of a
+bucket are an exact running mean/variance, after that the bucket decays
+exponentially so old behaviour is forgotten. Memory is bounded by
+entities x metrics x 168 x 3 floats.
+
+A reading is flagged, in order of precedence, as:
+- invalid: outside the metric's physical range
+- stuck: pinned at a range bound for STUCK_RUN consecutive readings
+- jump: moved more than the metric's max_jump within JUMP_WINDOW
+- outlier: more than Z_THRESHOLD standard deviations from its bucket mean
+Only unflagged readings update the statistics, last value and stuck run, so
+the normal reading after a spike is compared with the reading before it.
+Ingestion records a reading only once it is committed, so a rolled back
+ingest leaves the statistics untouched.
+
+State lives in the process and is primed from the last PRIME_DAYS days of
+readings on startup; after that each process sees only the readings it
+ingests. Run ingestion on a single worker (or restart workers to re-prime)
+when serving with several.
+"""
+import math
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session, Query
+
+from database.models import ParkingUsage, TrafficData, AnomalyFlag
+from database.regions import RegionLocal
+
+STATS_WINDOW = 50
+MIN_SAMPLES = 8  # Bucket samples needed before z-scores are trusted
+Z_THRESHOLD = 4.0
+MIN_STDDEV = 1.0  # Floor so near-constant buckets don't flag tiny changes
+STUCK_RUN = 6
+JUMP_WINDOW = timedelta(hours=1)
+PRIME_DAYS = 28
+
+# Per-metric physical range and maximum plausible change within JUMP_WINDOW
+METRICS = {
+    "occupancy_rate": {"low": 0.0, "high": 100.0, "max_jump": 60.0},
+    "vehicle_count": {"low": 0.0, "high": None, "max_jump": None},
+    "average_speed": {"low": 0.0, "high": 150.0, "max_jump": 60.0},
+}
+
+SOURCE_MODELS = {
+    "parking_usage": ParkingUsage,
+    "traffic_data": TrafficData,
+}
+
+
+class _EntityState:
+    __slots__ = ("buckets", "last_value", "last_timestamp", "stuck_run")
+
+    def __init__(self):
+        # hour-of-week -> [count, mean, variance]
+        self.buckets: Dict[int, List[float]] = {}
+        self.last_value: Optional[float] = None
+        self.last_timestamp: Optional[datetime] = None
+        self.stuck_run = 0
+
+
+class AnomalyDetector:
+    """Incremental per-entity statistics and anomaly rules"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._states: Dict[Tuple[str, int, str], _EntityState] = {}
+        self._prime_lock = threading.Lock()
+        self.primed = False
+
+    def _state(self, source: str, entity_id: int, metric: str) -> _EntityState:
+        state = self._states.get((source, entity_id, metric))
+        if state is None:
+            state = self._states[(source, entity_id, metric)] = _EntityState()
+        return state
+
+    @staticmethod
+    def _stuck_run(state: _EntityState, value: float, at_bound: bool) -> int:
+        if at_bound and value == state.last_value:
+            return state.stuck_run + 1
+        return 1 if at_bound else 0
+
+    def check(
+        self,
+        source: str,
+        entity_id: int,
+        metric: str,
+        timestamp: datetime,
+        value: Optional[float]
+    ) -> Optional[dict]:
+        """Check a reading against its entity's history without changing it.
+
+        Returns a flag dict (reason, expected, score) or None.
+        """
+        if value is None:
+            return None
+
+        limits = METRICS[metric]
+        low, high = limits["low"], limits["high"]
+        at_bound = value == low or (high is not None and value == high)
+
+        with self._lock:
+            state = self._states.get((source, entity_id, metric))
+            bucket = state.buckets.get(timestamp.weekday() * 24 + timestamp.hour) if state else None
+            expected = bucket[1] if bucket else None
+
+            if value < low or (high is not None and value > high):
+                return {"reason": "invalid", "expected": expected, "score": None}
+            if state is None:
+                return None
+
+            recent = (
+                state.last_timestamp is not None
+                and abs(timestamp - state.last_timestamp) <= JUMP_WINDOW
+            )
+            if self._stuck_run(state, value, at_bound) >= STUCK_RUN:
+                return {"reason": "stuck", "expected": expected, "score": None}
+            if (limits["max_jump"] is not None and recent
+                    and abs(value - state.last_value) > limits["max_jump"]):
+                return {"reason": "jump", "expected": state.last_value, "score": None}
+            if bucket and bucket[0] >= MIN_SAMPLES:
+                stddev = max(math.sqrt(bucket[2]), MIN_STDDEV)
+                z = (value - bucket[1]) / stddev
+                if abs(z) > Z_THRESHOLD:
+                    return {"reason": "outlier", "expected": expected, "score": round(z, 2)}
+        return None
+
+    def record(self, source: str, entity_id: int, metric: str, timestamp: datetime, value: Optional[float]):
+        """Add an unflagged reading to its entity's statistics"""
+        if value is None:
+            return
+
+        limits = METRICS[metric]
+        at_bound = value == limits["low"] or (limits["high"] is not None and value == limits["high"])
+        bucket_key = timestamp.weekday() * 24 + timestamp.hour
+
+        with self._lock:
+            state = self._state(source, entity_id, metric)
+            state.stuck_run = self._stuck_run(state, value, at_bound)
+            state.last_value = value
+            state.last_timestamp = timestamp
+
+            bucket = state.buckets.get(bucket_key)
+            if bucket is None:
+                bucket = state.buckets[bucket_key] = [0, 0.0, 0.0]
+            # Exact running mean/variance up to STATS_WINDOW, exponential decay after
+            bucket[0] = min(bucket[0] + 1, STATS_WINDOW)
+            alpha = 1.0 / bucket[0]
+            delta = value - bucket[1]
+            bucket[1] += alpha * delta
+            bucket[2] = (1.0 - alpha) * (bucket[2] + alpha * delta * delta)
+
+    def observe(
+        self,
+        source: str,
+        entity_id: int,
+        metric: str,
+        timestamp: datetime,
+        value: Optional[float]
+    ) -> Optional[dict]:
+        """Check a reading and record it if it isn't flagged"""
+        flag = self.check(source, entity_id, metric, timestamp, value)
+        if flag is None:
+            self.record(source, entity_id, metric, timestamp, value)
+        return flag
+
+    def prime(self, db: Session, days: int = PRIME_DAYS):
+        """Warm the statistics from recent history without flagging anything"""
+        cutoff = datetime.now() - timedelta(days=days)
+
+        usage_rows = db.query(
+            ParkingUsage.zone_id, ParkingUsage.timestamp, ParkingUsage.occupancy_rate
+        ).filter(ParkingUsage.timestamp >= cutoff).order_by(ParkingUsage.timestamp).yield_per(5000)
+        for zone_id, timestamp, occupancy_rate in usage_rows:
+            self.observe("parking_usage", zone_id, "occupancy_rate", timestamp, occupancy_rate)
+
+        traffic_rows = db.query(
+            TrafficData.sensor_id, TrafficData.timestamp,
+            TrafficData.vehicle_count, TrafficData.average_speed
+        ).filter(TrafficData.timestamp >= cutoff).order_by(TrafficData.timestamp).yield_per(5000)
+        for sensor_id, timestamp, vehicle_count, average_speed in traffic_rows:
+            self.observe("traffic_data", sensor_id, "vehicle_count", timestamp, vehicle_count)
+            self.observe("traffic_data", sensor_id, "average_speed", timestamp, average_speed)
+
+        self.primed = True
+
+    def ensure_primed(self, db: Session):
+        """Prime once, on first use (call before adding the new reading)"""
+        if self.primed:
+            return
+        with self._prime_lock:
+            if not self.primed:
+                self.prime(db)
+
+
+def flag_reading(
+    db: Session,
+    source: str,
+    reading_id: int,
+    entity_id: int,
+    timestamp: datetime,
+    values: Dict[str, Optional[float]]
+) -> List[AnomalyFlag]:
+    """Check every metric of a stored reading and add flags to the session.
+
+    The statistics are left unchanged; call record_reading() once the
+    reading is committed.
+    """
+    flags = []
+    for metric, value in values.items():
+        result = detectors.get().check(source, entity_id, metric, timestamp, value)
+        if result is None:
+            continue
+        flag = AnomalyFlag(
+            source=source,
+            reading_id=reading_id,
+            entity_id=entity_id,
+            timestamp=timestamp,
+            metric=metric,
+            value=value,
+            expected=round(result["expected"], 2) if result["expected"] is not None else None,
+            score=result["score"],
+            reason=result["reason"]
+        )
+        db.add(flag)
+        flags.append(flag)
+    return flags
+
+
+def record_reading(
+    source: str,
+    entity_id: int,
+    timestamp: datetime,
+    values: Dict[str, Optional[float]],
+    flags: List[AnomalyFlag]
+):
+    """Add the unflagged metrics of a committed reading to the detector's statistics"""
+    flagged = {flag.metric for flag in flags}
+    for metric, value in values.items():
+        if metric not in flagged:
+            detectors.get().record(source, entity_id, metric, timestamp, value)
+
+
+def exclude_flagged(query: Query, source: str) -> Query:
+    """Filter flagged readings out of a query over the source table"""
+    model = SOURCE_MODELS[source]
+    flagged = select(AnomalyFlag.reading_id).where(AnomalyFlag.source == source)
+    return query.filter(model.id.notin_(flagged))
+
+
+# Per-region detectors used by ingestion
+detectors = RegionLocal(lambda shard: AnomalyDetector())
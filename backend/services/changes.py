@@ -0,0 +1,147 @@
+# services/changes.py
+"""
+Change feed for incremental (delta) sync.
+
+Every write to a tracked table appends a row to change_log with a
+monotonically increasing `seq` (see database/models.py). A client keeps the
+last seq it has applied as its cursor and asks for changes after it; each
+changed row is returned once, in its current state, so the payload grows
+with the number of changed rows rather than the size of the tables.
+
+Cursors are per region shard. Log entries older than the retention period
+are pruned (the newest entry is always kept), so the oldest retained seq
+tells whether a cursor can still be served. An expired cursor means the
+client has to reload from the regular endpoints and resume from a fresh one.
+
+The log is written by triggers that only exist on SQLite; on other
+databases the feed raises ChangeFeedUnavailable rather than reporting that
+nothing changed.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.orm import Session
+
+from database.models import Base, ChangeLog, CHANGE_LOG_DIALECTS, CHANGE_TRACKED_TABLES
+
+CHANGE_LOG_RETENTION_DAYS = 30
+ROW_FETCH_CHUNK = 500  # Stay under SQLite's bound parameter limit
+
+
+class CursorExpired(Exception):
+    """Raised when a cursor is older than the retained log or from another log"""
+
+
+class ChangeFeedUnavailable(Exception):
+    """Raised when the database has no change log triggers"""
+
+
+def _require_change_log(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect not in CHANGE_LOG_DIALECTS:
+        raise ChangeFeedUnavailable(f"The change feed is not available on {dialect} databases")
+
+
+def current_cursor(db: Session) -> int:
+    """Sequence number of the newest recorded change (0 if none)"""
+    _require_change_log(db)
+    return db.execute(select(func.max(ChangeLog.seq))).scalar() or 0
+
+
+def _fetch_rows(db: Session, table_name: str, row_ids: Sequence[int]) -> Dict[int, dict]:
+    table = Base.metadata.tables[table_name]
+    rows = {}
+    for start in range(0, len(row_ids), ROW_FETCH_CHUNK):
+        chunk = row_ids[start:start + ROW_FETCH_CHUNK]
+        for row in db.execute(select(table).where(table.c.id.in_(chunk))).mappings():
+            rows[row["id"]] = dict(row)
+    return rows
+
+
+def get_changes(db: Session, since: int, tables: Optional[List[str]] = None, limit: int = 1000) -> dict:
+    """Rows inserted, updated or deleted after cursor `since`.
+
+    Reads at most `limit` log entries; `has_more` tells the client to call
+    again with the returned cursor. Several changes to one row collapse to
+    one entry: "deleted" if its last change was a delete, "inserted" if it
+    was created after the cursor, "updated" otherwise.
+    """
+    _require_change_log(db)
+    bounds = db.execute(select(func.min(ChangeLog.seq), func.max(ChangeLog.seq))).one()
+    oldest, newest = bounds[0] or 0, bounds[1] or 0
+    if since > newest or (oldest and since < oldest - 1):
+        raise CursorExpired(f"Cursor {since} is outside the retained change log ({oldest}-{newest})")
+
+    query = select(ChangeLog).where(ChangeLog.seq > since)
+    if tables:
+        query = query.where(ChangeLog.table_name.in_(tables))
+    entries = db.execute(query.order_by(ChangeLog.seq).limit(limit + 1)).scalars().all()
+
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    # The two reads aren't one snapshot (pysqlite begins no transaction for SELECTs), so
+    # entries committed after the bounds query may be returned; the cursor must cover them
+    if has_more:
+        cursor = entries[-1].seq
+    else:
+        cursor = max(newest, entries[-1].seq) if entries else newest
+
+    # Collapse to the first and last operation per row
+    collapsed: Dict[tuple, list] = {}
+    for entry in entries:
+        key = (entry.table_name, entry.row_id)
+        if key in collapsed:
+            collapsed[key][1] = entry.operation
+        else:
+            collapsed[key] = [entry.operation, entry.operation]
+
+    changes: Dict[str, dict] = {}
+    wanted: Dict[str, List[int]] = {}
+    for (table_name, row_id), (first, last) in collapsed.items():
+        table_changes = changes.setdefault(table_name, {"inserted": [], "updated": [], "deleted": []})
+        if last == "delete":
+            if first != "insert":  # Created and deleted since the cursor: nothing to sync
+                table_changes["deleted"].append(row_id)
+        else:
+            wanted.setdefault(table_name, []).append(row_id)
+
+    for table_name, row_ids in wanted.items():
+        rows = _fetch_rows(db, table_name, row_ids)
+        for row_id in row_ids:
+            first, _ = collapsed[(table_name, row_id)]
+            row = rows.get(row_id)
+            if row is None:
+                # Deleted after this page; a later page carries the delete
+                continue
+            kind = "inserted" if first == "insert" else "updated"
+            changes[table_name][kind].append(row)
+
+    return {
+        "since": since,
+        "cursor": cursor,
+        "has_more": has_more,
+        "changes": {
+            table_name: table_changes for table_name, table_changes in changes.items()
+            if any(table_changes.values())
+        }
+    }
+
+
+def prune_change_log(db: Session, retention_days: int = CHANGE_LOG_RETENTION_DAYS):
+    """Delete log entries older than the retention period, keeping the newest"""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    newest = current_cursor(db)
+    db.execute(delete(ChangeLog).where(ChangeLog.changed_at < cutoff, ChangeLog.seq < newest))
+    db.commit()
+
+
+def validate_tables(tables: Optional[str]) -> Optional[List[str]]:
+    """Parse a comma-separated table list, rejecting untracked tables"""
+    if not tables:
+        return None
+    names = [name.strip() for name in tables.split(",") if name.strip()]
+    unknown = [name for name in names if name not in CHANGE_TRACKED_TABLES]
+    if unknown:
+        raise ValueError(f"Unknown tables: {', '.join(unknown)}")
+    return names
@@ -0,0 +1,122 @@
+# services/concurrency.py
+"""
+Request coalescing and load shedding for expensive endpoints.
+
+`coalesced()` runs a query function in the threadpool with its own session
+on the current region's shard.
+Concurrent calls with the same key share one computation (single-flight),
+so a burst of identical requests costs one set of queries. Distinct
+computations per route are capped by a RouteLimiter: when all slots are
+busy, callers queue up to `max_queue` deep for at most `queue_timeout`
+seconds and are otherwise shed with a 503 and a Retry-After header.
+"""
+import asyncio
+import math
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from database.regions import current_region, run_in_region
+
+T = TypeVar("T")
+
+# Per-route limits on concurrent distinct computations
+ROUTE_LIMITS = {
+    "parking_zones": {"max_concurrent": 4, "max_queue": 16, "queue_timeout": 2.0},
+    "parking_live": {"max_concurrent": 4, "max_queue": 16, "queue_timeout": 2.0},
+    "analytics_summary": {"max_concurrent": 2, "max_queue": 8, "queue_timeout": 2.0},
+    "analytics_queries": {"max_concurrent": 2, "max_queue": 8, "queue_timeout": 5.0},
+}
+
+
+class Overloaded(Exception):
+    """Raised when a route has no free slot within its queue limits"""
+
+    def __init__(self, route: str, retry_after: int):
+        super().__init__(f"{route} is saturated")
+        self.route = route
+        self.retry_after = retry_after
+
+
+class RouteLimiter:
+    """Async semaphore with a bounded, time-limited wait queue"""
+
+    def __init__(self, route: str, max_concurrent: int, max_queue: int, queue_timeout: float):
+        self.route = route
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self.shed = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+
+    def _overloaded(self) -> Overloaded:
+        self.shed += 1
+        return Overloaded(self.route, max(1, math.ceil(self.queue_timeout)))
+
+    async def __aenter__(self):
+        if not self._semaphore.locked():
+            await self._semaphore.acquire()
+            return self
+
+        if self.waiting >= self.max_queue:
+            raise self._overloaded()
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise self._overloaded()
+        finally:
+            self.waiting -= 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self._semaphore.release()
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one shared task"""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self._inflight[key] = future
+
+            def forget(done, key=key):
+                if self._inflight.get(key) is done:
+                    del self._inflight[key]
+
+            future.add_done_callback(forget)
+
+        # A cancelled waiter must not cancel the computation other waiters share
+        return await asyncio.shield(future)
+
+
+single_flight = SingleFlight()
+route_limiters = {route: RouteLimiter(route, **limits) for route, limits in ROUTE_LIMITS.items()}
+
+
+async def coalesced(route: str, key: tuple, fn: Callable[[Session], Any]) -> Any:
+    """Run fn(db) in the threadpool, shared by identical concurrent requests in the same region"""
+    limiter = route_limiters[route]
+    region = current_region.get()
+
+    async def compute():
+        async with limiter:
+            return await run_in_threadpool(run_in_region, region, fn)
+
+    try:
+        return await single_flight.do((route, region) + key, compute)
+    except Overloaded as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Service busy, retry in {e.retry_after}s",
+            headers={"Retry-After": str(e.retry_after)}
+        )
@@ -0,0 +1,84 @@
+# services/ingest.py
+"""
+Ingestion of new parking usage and traffic readings.
+
+Every write of a reading goes through these functions so the derived state
+(anomaly flags, occupancy sketches) is updated in the same transaction, the in-memory
+occupancy store catches up and background jobs subscribed to the table
+are notified.
+"""
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from database.models import ParkingZone, ParkingUsage, TrafficSensor, TrafficData, AnomalyFlag
+from database.regions import current_region
+from services.anomalies import detectors, flag_reading, record_reading
+from services.scheduler import scheduler
+from services.sketches import add_reading
+from services.timeseries import occupancy_stores
+
+
+def ingest_parking_usage(
+    db: Session,
+    zone: ParkingZone,
+    timestamp: datetime,
+    occupied_spaces: int,
+    total_spaces: Optional[int] = None
+) -> Tuple[ParkingUsage, List[AnomalyFlag]]:
+    """Store a parking usage reading and flag it if anomalous"""
+    detectors.get().ensure_primed(db)
+    total_spaces = total_spaces if total_spaces is not None else zone.total_spaces
+    occupancy_rate = round(occupied_spaces / total_spaces * 100, 1) if total_spaces else None
+
+    usage = ParkingUsage(
+        zone_id=zone.id,
+        timestamp=timestamp,
+        occupied_spaces=occupied_spaces,
+        total_spaces=total_spaces,
+        occupancy_rate=occupancy_rate,
+        hour_of_day=timestamp.hour,
+        day_of_week=timestamp.weekday()
+    )
+    db.add(usage)
+    db.flush()  # Assign usage.id for the flags
+
+    values = {"occupancy_rate": occupancy_rate}
+    flags = flag_reading(db, "parking_usage", usage.id, zone.id, timestamp, values)
+    add_reading(db, zone.id, timestamp, occupancy_rate)
+    db.commit()
+    record_reading("parking_usage", zone.id, timestamp, values, flags)
+    occupancy_stores.get().catch_up(db)
+    scheduler.notify(f"{current_region.get()}:parking_usage")
+    return usage, flags
+
+
+def ingest_traffic_data(
+    db: Session,
+    sensor: TrafficSensor,
+    timestamp: datetime,
+    vehicle_count: Optional[int] = None,
+    average_speed: Optional[float] = None,
+    congestion_level: Optional[str] = None
+) -> Tuple[TrafficData, List[AnomalyFlag]]:
+    """Store a traffic sensor reading and flag it if anomalous"""
+    detectors.get().ensure_primed(db)
+    reading = TrafficData(
+        sensor_id=sensor.id,
+        timestamp=timestamp,
+        vehicle_count=vehicle_count,
+        average_speed=average_speed,
+        congestion_level=congestion_level,
+        hour_of_day=timestamp.hour,
+        day_of_week=timestamp.weekday()
+    )
+    db.add(reading)
+    db.flush()
+
+    values = {"vehicle_count": vehicle_count, "average_speed": average_speed}
+    flags = flag_reading(db, "traffic_data", reading.id, sensor.id, timestamp, values)
+    db.commit()
+    record_reading("traffic_data", sensor.id, timestamp, values, flags)
+    scheduler.notify(f"{current_region.get()}:traffic_data")
+    return reading, flags
@@ -0,0 +1,119 @@
+# services/jobs.py
+"""
+Background jobs registered with the scheduler at startup.
+
+Every job is registered once per region and runs against that region's
+shard. Cache refreshes run on every worker because each worker holds its
+own in-memory copy; database maintenance runs on the leader only.
+"""
+from datetime import datetime, timedelta
+from functools import partial
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from database.models import AnomalyFlag
+from database.query_log import slow_query_log
+from database.regions import router, run_in_region
+from services.analytics import analytics_engines
+from services.anomalies import detectors
+from services.changes import prune_change_log
+from services.map_tiles import tile_caches
+from services.recommendations import recommendation_engines
+from services.scheduler import Job, Scheduler
+from services import sketches
+from services.timeseries import occupancy_stores, CATCH_UP_SECONDS
+
+ANOMALY_RETENTION_DAYS = 90
+DAY_SECONDS = 24 * 60 * 60
+
+
+def refresh_map_tiles(db: Session):
+    """Reload the map feature snapshot, evicting changed tiles"""
+    tile_caches.get().refresh(db)
+
+
+def refresh_recommendation_features(db: Session):
+    """Rebuild the recommendation feature arrays"""
+    recommendation_engines.get().refresh(db)
+
+
+def sync_analytics_engine(db: Session):
+    """Copy new readings into the analytics engine"""
+    analytics_engines.get().sync()
+
+
+def prime_anomaly_detector(db: Session):
+    """Warm anomaly statistics so the first ingests are checked against history"""
+    detectors.get().ensure_primed(db)
+
+
+def load_occupancy_store(db: Session):
+    """Fill the in-memory occupancy buffers from the database"""
+    occupancy_stores.get().load(db)
+
+
+def catch_up_occupancy_store(db: Session):
+    """Append readings written by other workers or scripts and refresh zone metadata"""
+    store = occupancy_stores.get()
+    store.refresh_zones(db)
+    store.catch_up(db)
+
+
+def verify_occupancy_store(db: Session):
+    """Rebuild the occupancy buffers if they drifted from the database"""
+    store = occupancy_stores.get()
+    report = store.verify(db)
+    if not report["consistent"]:
+        print(f"Occupancy store out of sync for zones {report['mismatched_zones']}; reloading")
+        store.load(db)
+
+
+def verify_occupancy_sketches(db: Session):
+    """Rebuild occupancy sketches of zones with readings written outside ingestion"""
+    report = sketches.verify(db)
+    if report["rebuilt_zones"]:
+        print(f"Rebuilt occupancy sketches for zones {report['rebuilt_zones']}")
+
+
+def prune_anomaly_flags(db: Session):
+    """Delete anomaly flags older than the retention period"""
+    cutoff = datetime.now() - timedelta(days=ANOMALY_RETENTION_DAYS)
+    db.query(AnomalyFlag).filter(AnomalyFlag.timestamp < cutoff).delete(synchronize_session=False)
+    db.commit()
+
+
+def optimize_database(db: Session):
+    """Refresh SQLite query planner statistics"""
+    if db.get_bind().dialect.name == "sqlite":
+        db.execute(text("PRAGMA optimize"))
+
+
+def register_jobs(scheduler: Scheduler):
+    """Register the app's background jobs for every region"""
+    if slow_query_log.enabled:
+        scheduler.add(Job("log_slow_queries", slow_query_log.log_summary, interval=15 * 60))
+
+    for region in router.regions():
+        def add(name, fn, triggers=(), **options):
+            scheduler.add(Job(
+                f"{name}:{region}", partial(run_in_region, region, fn),
+                triggers=[f"{region}:{event}" for event in triggers], **options
+            ))
+
+        add("refresh_map_tiles", refresh_map_tiles,
+            interval=20, triggers=["parking_usage", "traffic_data"], run_on_start=True)
+        add("refresh_recommendation_features", refresh_recommendation_features,
+            interval=240, triggers=["parking_usage"], debounce=30, run_on_start=True)
+        if analytics_engines.get(region).name != "sqlite":
+            add("sync_analytics_engine", sync_analytics_engine,
+                interval=60, triggers=["parking_usage", "traffic_data"], debounce=10, run_on_start=True)
+        add("load_occupancy_store", load_occupancy_store, run_on_start=True)
+        add("catch_up_occupancy_store", catch_up_occupancy_store, interval=CATCH_UP_SECONDS)
+        add("verify_occupancy_store", verify_occupancy_store, interval=15 * 60)
+        add("prime_anomaly_detector", prime_anomaly_detector, run_on_start=True)
+        add("verify_occupancy_sketches", verify_occupancy_sketches,
+            interval=60 * 60, run_on_start=True, leader_only=True)
+        add("prune_anomaly_flags", prune_anomaly_flags, interval=DAY_SECONDS, leader_only=True)
+        add("prune_change_log", prune_change_log, interval=DAY_SECONDS, leader_only=True)
+        add("optimize_database", optimize_database, interval=DAY_SECONDS, leader_only=True)
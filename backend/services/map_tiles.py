@@ -0,0 +1,269 @@
+# services/map_tiles.py
+"""
+Precomputed GeoJSON tiles for the parking and traffic map layer.
+
+Parking zones and traffic sensors are snapshotted (with their latest
+occupancy / congestion reading) and served as web-mercator tiles. Points
+are clustered on a pixel grid below CLUSTER_MAX_ZOOM so a city-wide view
+stays small. Encoded tiles, empty ones included, are cached per z/x/y in
+an LRU of at most MAX_CACHED_TILES entries. The refresh_map_tiles job
+reloads the snapshot and evicts only the tiles a changed, added or removed
+feature falls in; the first request loads it if the job hasn't run yet.
+"""
+import hashlib
+import json
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database.models import ParkingZone, ParkingUsage, TrafficSensor, TrafficData
+from database.regions import RegionLocal
+
+# Tile configuration
+TILE_SIZE = 256
+MAX_ZOOM = 20
+CLUSTER_CELL_PX = 64  # Points in the same 64x64 px cell are merged
+CLUSTER_MAX_ZOOM = 16  # From this zoom on every feature is drawn individually
+MAX_CACHED_TILES = 4096
+
+CONGESTION_SEVERITY = {"low": 0, "medium": 1, "high": 2, "severe": 3}
+
+
+def lnglat_to_tile(lng: float, lat: float, z: int) -> Tuple[float, float]:
+    """Convert a coordinate to fractional tile coordinates at zoom z"""
+    n = 2 ** z
+    lat = max(min(lat, 85.05112878), -85.05112878)
+    lat_rad = math.radians(lat)
+    fx = (lng + 180.0) / 360.0 * n
+    fy = (1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n
+    return fx, fy
+
+
+def tile_bounds(z: int, x: int, y: int) -> Tuple[float, float, float, float]:
+    """Get (west, south, east, north) bounds of a tile"""
+    n = 2 ** z
+
+    def lat(ty):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+
+def load_map_features(db: Session) -> Dict[Tuple[str, int], dict]:
+    """Load zones and sensors with their latest reading, keyed by (kind, id)"""
+    features = {}
+
+    # Latest usage row per zone in a single grouped query
+    latest_usage = db.query(
+        ParkingUsage.zone_id,
+        func.max(ParkingUsage.timestamp).label("timestamp")
+    ).group_by(ParkingUsage.zone_id).subquery()
+
+    zones = db.query(ParkingZone, ParkingUsage).outerjoin(
+        latest_usage, latest_usage.c.zone_id == ParkingZone.id
+    ).outerjoin(
+        ParkingUsage,
+        (ParkingUsage.zone_id == latest_usage.c.zone_id)
+        & (ParkingUsage.timestamp == latest_usage.c.timestamp)
+    ).filter(ParkingZone.is_active == True).all()
+
+    for zone, usage in zones:
+        if zone.latitude is None or zone.longitude is None:
+            continue
+        features[("parking_zone", zone.id)] = {
+            "lat": zone.latitude,
+            "lng": zone.longitude,
+            "properties": {
+                "kind": "parking_zone",
+                "id": zone.id,
+                "name": zone.zone_name,
+                "code": zone.zone_code,
+                "total_spaces": zone.total_spaces,
+                "hourly_rate": zone.hourly_rate,
+                "occupied_spaces": usage.occupied_spaces if usage else None,
+                "occupancy_rate": usage.occupancy_rate if usage else None,
+                "updated": usage.timestamp.isoformat() if usage else None
+            }
+        }
+
+    # Latest traffic reading per sensor
+    latest_traffic = db.query(
+        TrafficData.sensor_id,
+        func.max(TrafficData.timestamp).label("timestamp")
+    ).group_by(TrafficData.sensor_id).subquery()
+
+    sensors = db.query(TrafficSensor, TrafficData).outerjoin(
+        latest_traffic, latest_traffic.c.sensor_id == TrafficSensor.id
+    ).outerjoin(
+        TrafficData,
+        (TrafficData.sensor_id == latest_traffic.c.sensor_id)
+        & (TrafficData.timestamp == latest_traffic.c.timestamp)
+    ).filter(TrafficSensor.is_active == True).all()
+
+    for sensor, reading in sensors:
+        if sensor.latitude is None or sensor.longitude is None:
+            continue
+        features[("traffic_sensor", sensor.id)] = {
+            "lat": sensor.latitude,
+            "lng": sensor.longitude,
+            "properties": {
+                "kind": "traffic_sensor",
+                "id": sensor.id,
+                "sensor_id": sensor.sensor_id,
+                "name": sensor.location_name,
+                "road_type": sensor.road_type,
+                "vehicle_count": reading.vehicle_count if reading else None,
+                "average_speed": reading.average_speed if reading else None,
+                "congestion_level": reading.congestion_level if reading else None,
+                "updated": reading.timestamp.isoformat() if reading else None
+            }
+        }
+
+    return features
+
+
+def _point(feature: dict, properties: dict) -> dict:
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [feature["lng"], feature["lat"]]},
+        "properties": properties
+    }
+
+
+def _cluster(members: List[dict]) -> dict:
+    """Merge several features into one cluster point with aggregated state"""
+    lat = sum(m["lat"] for m in members) / len(members)
+    lng = sum(m["lng"] for m in members) / len(members)
+
+    zones = [m["properties"] for m in members if m["properties"]["kind"] == "parking_zone"]
+    sensors = [m["properties"] for m in members if m["properties"]["kind"] == "traffic_sensor"]
+
+    total_spaces = sum(z["total_spaces"] or 0 for z in zones if z["occupied_spaces"] is not None)
+    occupied = sum(z["occupied_spaces"] for z in zones if z["occupied_spaces"] is not None)
+    levels = [s["congestion_level"] for s in sensors if s["congestion_level"] in CONGESTION_SEVERITY]
+
+    return _point({"lat": lat, "lng": lng}, {
+        "cluster": True,
+        "point_count": len(members),
+        "parking_zones": len(zones),
+        "traffic_sensors": len(sensors),
+        "total_spaces": sum(z["total_spaces"] or 0 for z in zones),
+        "occupied_spaces": occupied,
+        "occupancy_rate": round(occupied / total_spaces * 100, 1) if total_spaces else None,
+        "congestion_level": max(levels, key=CONGESTION_SEVERITY.get) if levels else None
+    })
+
+
+def build_tile(features: List[dict], z: int, x: int, y: int) -> dict:
+    """Build a GeoJSON FeatureCollection for one tile"""
+    cells: Dict[Tuple[int, int], List[dict]] = {}
+
+    for feature in features:
+        fx, fy = lnglat_to_tile(feature["lng"], feature["lat"], z)
+        if int(fx) != x or int(fy) != y:
+            continue
+        if z >= CLUSTER_MAX_ZOOM:
+            cell = (feature["properties"]["kind"], feature["properties"]["id"])
+        else:
+            cell = (
+                int((fx - x) * TILE_SIZE // CLUSTER_CELL_PX),
+                int((fy - y) * TILE_SIZE // CLUSTER_CELL_PX)
+            )
+        cells.setdefault(cell, []).append(feature)
+
+    out = []
+    for members in cells.values():
+        if len(members) == 1:
+            out.append(_point(members[0], dict(members[0]["properties"], cluster=False)))
+        else:
+            out.append(_cluster(members))
+
+    return {
+        "type": "FeatureCollection",
+        "bbox": list(tile_bounds(z, x, y)),
+        "features": out
+    }
+
+
+class TileCache:
+    """Encoded tile cache with per-feature invalidation"""
+
+    def __init__(self, max_tiles: int = MAX_CACHED_TILES):
+        self.max_tiles = max_tiles
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._features: Dict[Tuple[str, int], dict] = {}
+        self._tiles: "OrderedDict[Tuple[int, int, int], Tuple[str, bytes]]" = OrderedDict()
+        self._loaded = False
+
+    def _tiles_for(self, feature: dict) -> List[Tuple[int, int, int]]:
+        zooms = {key[0] for key in self._tiles}
+        keys = []
+        for z in zooms:
+            fx, fy = lnglat_to_tile(feature["lng"], feature["lat"], z)
+            keys.append((z, int(fx), int(fy)))
+        return keys
+
+    def refresh(self, db: Session) -> int:
+        """Reload the feature snapshot and evict tiles whose features changed"""
+        features = load_map_features(db)
+        evicted = 0
+
+        with self._lock:
+            previous = self._features
+            for key in previous.keys() | features.keys():
+                old, new = previous.get(key), features.get(key)
+                if old == new:
+                    continue
+                for feature in (old, new):
+                    if feature is None:
+                        continue
+                    for tile_key in self._tiles_for(feature):
+                        if self._tiles.pop(tile_key, None) is not None:
+                            evicted += 1
+
+            self._features = features
+            self._loaded = True
+
+        return evicted
+
+    def get_tile(self, db: Session, z: int, x: int, y: int) -> Tuple[str, bytes]:
+        """Get (etag, encoded GeoJSON) for a tile, building it on a miss"""
+        if not self._loaded:
+            with self._load_lock:
+                if not self._loaded:
+                    self.refresh(db)
+
+        with self._lock:
+            cached = self._tiles.get((z, x, y))
+            if cached is not None:
+                self._tiles.move_to_end((z, x, y))
+                return cached
+            snapshot = self._features
+
+        tile = build_tile(list(snapshot.values()), z, x, y)
+        body = json.dumps(tile, separators=(",", ":")).encode()
+        entry = (hashlib.sha1(body).hexdigest()[:16], body)
+
+        with self._lock:
+            # Don't cache a tile built from a snapshot that was replaced meanwhile
+            if self._features is snapshot:
+                self._tiles[(z, x, y)] = entry
+                while len(self._tiles) > self.max_tiles:
+                    self._tiles.popitem(last=False)
+        return entry
+
+    def clear(self):
+        """Drop every cached tile and the feature snapshot"""
+        with self._lock:
+            self._tiles.clear()
+            self._features = {}
+            self._loaded = False
+
+
+# Per-region caches used by the API
+tile_caches = RegionLocal(lambda shard: TileCache())
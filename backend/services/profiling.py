@@ -0,0 +1,282 @@
+# services/profiling.py
+"""
+Opt-in per-request CPU profiling.
+
+A request is profiled when it carries `X-Profile: 1` together with a valid
+admin token, or when it is picked by PROFILE_SAMPLE_RATE (0 by default).
+While it runs, a sampler thread snapshots the Python stacks of the event
+loop thread and the threadpool workers (where coalesced queries, ORM
+hydration and sync dependencies run) every PROFILE_INTERVAL_MS. Idle
+threads are skipped. Samples are not attributed to a request, so a capture
+also contains whatever else the server was doing at the time; the number
+of requests in flight is recorded with it.
+
+Captures are written in speedscope's JSON format (one profile per thread)
+to PROFILE_DIR, keeping the newest PROFILE_MAX_FILES, and can be converted
+to collapsed stacks for flamegraph tools. Each capture's request metadata
+is also written to a small sidecar file, so listing captures doesn't parse
+the profiles. Only one request is profiled at a
+time. When no request is profiled, the cost is one header lookup and, if
+sampling is enabled, one random() call per request.
+"""
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+
+from services.admin import is_admin
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "50"))
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "2"))
+
+PROFILE_ID = re.compile(r"^[0-9]{8}T[0-9]{12}-[0-9a-f]{8}$")
+WORKER_THREAD_PREFIX = "AnyIO worker thread"
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+META_SUFFIX = ".meta.json"
+
+# Leaf frames of a thread that is blocked waiting for work
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+}
+
+Frame = Tuple[str, str, int]
+
+
+class Sampler(threading.Thread):
+    """Periodically records the stacks of the loop thread and threadpool workers"""
+
+    def __init__(self, loop_thread_id: int, interval: float):
+        super().__init__(name="request-profiler", daemon=True)
+        self.loop_thread_id = loop_thread_id
+        self.interval = interval
+        self.frames: Dict[Frame, int] = {}
+        self.samples: Dict[str, List[Tuple[List[int], float]]] = {}
+        self._stop_event = threading.Event()
+
+    def _thread_names(self) -> Dict[int, str]:
+        names = {self.loop_thread_id: "event loop"}
+        for thread in threading.enumerate():
+            if thread.name.startswith(WORKER_THREAD_PREFIX):
+                names[thread.ident] = thread.name
+        return names
+
+    def _stack(self, frame) -> Optional[List[int]]:
+        code = frame.f_code
+        if (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+            return None
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            key = (code.co_name, code.co_filename, code.co_firstlineno)
+            index = self.frames.get(key)
+            if index is None:
+                index = self.frames[key] = len(self.frames)
+            stack.append(index)
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def run(self):
+        last = time.perf_counter()
+        while not self._stop_event.wait(self.interval):
+            now = time.perf_counter()
+            weight = (now - last) * 1000
+            last = now
+            current = sys._current_frames()
+            for thread_id, name in self._thread_names().items():
+                frame = current.get(thread_id)
+                stack = self._stack(frame) if frame is not None else None
+                if stack:
+                    self.samples.setdefault(name, []).append((stack, weight))
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def speedscope(self, name: str, duration_ms: float) -> dict:
+        shared_frames = [None] * len(self.frames)
+        for (func, filename, line), index in self.frames.items():
+            shared_frames[index] = {"name": func, "file": filename, "line": line}
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": name,
+            "exporter": "melbourne-parking-api",
+            "shared": {"frames": shared_frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": thread_name,
+                    "unit": "milliseconds",
+                    "startValue": 0,
+                    "endValue": round(duration_ms, 3),
+                    "samples": [stack for stack, _ in samples],
+                    "weights": [round(weight, 3) for _, weight in samples]
+                }
+                for thread_name, samples in self.samples.items()
+            ]
+        }
+
+
+def to_collapsed(profile: dict) -> str:
+    """Convert a speedscope profile to collapsed stacks ("a;b;c <ms>" per line)"""
+    frames = [frame["name"] for frame in profile["shared"]["frames"]]
+    totals: Dict[str, float] = {}
+    for thread in profile["profiles"]:
+        for stack, weight in zip(thread["samples"], thread["weights"]):
+            key = ";".join([thread["name"]] + [frames[index] for index in stack])
+            totals[key] = totals.get(key, 0.0) + weight
+    return "".join(f"{stack} {max(1, round(ms))}\n" for stack, ms in sorted(totals.items()))
+
+
+class ProfileStore:
+    """Bounded directory of captured profiles, oldest evicted first"""
+
+    def __init__(self, directory: str = PROFILE_DIR, max_files: int = PROFILE_MAX_FILES):
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def _path(self, profile_id: str, suffix: str = ".speedscope.json") -> str:
+        if not PROFILE_ID.match(profile_id):
+            raise KeyError(profile_id)
+        return os.path.join(self.directory, profile_id + suffix)
+
+    def _write(self, path: str, data: dict):
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    def _ids(self) -> List[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        suffix = ".speedscope.json"
+        return sorted(
+            name[:-len(suffix)] for name in os.listdir(self.directory)
+            if name.endswith(suffix) and PROFILE_ID.match(name[:-len(suffix)])
+        )
+
+    def save(self, profile_id: str, profile: dict):
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            self._write(self._path(profile_id), profile)
+            self._write(self._path(profile_id, META_SUFFIX), profile["request"])
+            for old_id in self._ids()[:-self.max_files]:
+                os.remove(self._path(old_id))
+                try:
+                    os.remove(self._path(old_id, META_SUFFIX))
+                except FileNotFoundError:
+                    pass
+
+    def load(self, profile_id: str) -> dict:
+        try:
+            with open(self._path(profile_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise KeyError(profile_id)
+
+    def list(self) -> List[dict]:
+        """Capture metadata, newest first"""
+        captures = []
+        for profile_id in reversed(self._ids()):
+            try:
+                with open(self._path(profile_id, META_SUFFIX)) as f:
+                    captures.append(dict(json.load(f), id=profile_id))
+            except (OSError, ValueError):
+                continue  # Evicted meanwhile, or captured before sidecars existed
+        return captures
+
+
+class ProfilingMiddleware:
+    """ASGI middleware profiling opted-in or sampled requests"""
+
+    def __init__(self, app, store: Optional[ProfileStore] = None,
+                 sample_rate: float = PROFILE_SAMPLE_RATE, interval_ms: float = PROFILE_INTERVAL_MS):
+        self.app = app
+        self.store = store or profile_store
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000
+        self.in_flight = 0
+        self._busy = False
+
+    def _wanted(self, scope) -> bool:
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile") == b"1":
+            token = headers.get(b"x-admin-token")
+            return is_admin(token.decode("latin-1") if token else None)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        self.in_flight += 1
+        try:
+            if self._busy or not self._wanted(scope):
+                await self.app(scope, receive, send)
+                return
+            self._busy = True
+            try:
+                await self._profile(scope, receive, send)
+            finally:
+                self._busy = False
+        finally:
+            self.in_flight -= 1
+
+    async def _profile(self, scope, receive, send):
+        profile_id = f"{datetime.now():%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:8]}"
+        status = {}
+        max_in_flight = self.in_flight
+
+        async def send_with_id(message):
+            nonlocal max_in_flight
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message = dict(message, headers=list(message.get("headers", [])) + [
+                    (b"x-profile-id", profile_id.encode())
+                ])
+            max_in_flight = max(max_in_flight, self.in_flight)
+            await send(message)
+
+        sampler = Sampler(threading.get_ident(), self.interval)
+        started = time.perf_counter()
+        sampler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            await run_in_threadpool(sampler.stop)  # Joins the thread; keep it off the event loop
+            duration_ms = (time.perf_counter() - started) * 1000
+            request = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "query": scope.get("query_string", b"").decode("latin-1"),
+                "status": status.get("code"),
+                "duration_ms": round(duration_ms, 2),
+                "samples": sum(len(samples) for samples in sampler.samples.values()),
+                "interval_ms": self.interval * 1000,
+                "max_requests_in_flight": max_in_flight,
+                "captured_at": datetime.now().isoformat()
+            }
+            profile = sampler.speedscope(f"{scope['method']} {scope['path']}", duration_ms)
+            profile["request"] = request
+            try:
+                await run_in_threadpool(self.store.save, profile_id, profile)
+            except OSError as e:
+                print(f"Could not save profile {profile_id}: {e}")
+
+
+# Shared store used by the middleware and /admin/profiles
+profile_store = ProfileStore()
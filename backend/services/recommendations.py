@@ -0,0 +1,196 @@
+# services/recommendations.py
+"""
+Parking recommendations ranked by predicted availability, distance and price.
+
+Per-zone features are kept as NumPy arrays so a request scores every
+candidate zone in one vectorized pass. Expected free spaces come from the
+average occupancy per (day_of_week, hour_of_day) bucket in the usage
+history. The refresh_recommendation_features job rebuilds the arrays; the
+first request loads them if the job hasn't run yet.
+"""
+import threading
+import time
+import warnings
+from datetime import datetime
+from typing import Callable, List, Optional
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from database.models import ParkingZone, ParkingUsage
+from database.regions import RegionLocal
+
+HOURS_PER_WEEK = 7 * 24
+EARTH_RADIUS_M = 6371000.0
+WALK_DETOUR_FACTOR = 1.3  # Street grid vs straight line
+WALK_SPEED_M_PER_MIN = 80.0
+
+# Score weights (sum to 1)
+AVAILABILITY_WEIGHT = 0.5
+DISTANCE_WEIGHT = 0.3
+COST_WEIGHT = 0.2
+AVAILABILITY_SCALE = 10.0  # Free spaces at which availability score reaches ~63%
+
+
+class ZoneFeatures:
+    """Immutable per-zone feature arrays, aligned by index"""
+
+    def __init__(self, zones: list, occupancy_rows: list):
+        n = len(zones)
+        self.ids = np.array([z.id for z in zones], dtype=np.int64)
+        self.names = [z.zone_name for z in zones]
+        self.codes = [z.zone_code for z in zones]
+        self.lat = np.array([z.latitude for z in zones], dtype=np.float64)
+        self.lng = np.array([z.longitude for z in zones], dtype=np.float64)
+        self.lat_rad = np.radians(self.lat)
+        self.lng_rad = np.radians(self.lng)
+        self.total_spaces = np.array([z.total_spaces or 0 for z in zones], dtype=np.float64)
+        self.hourly_rate = np.array([z.hourly_rate or 0.0 for z in zones], dtype=np.float64)
+        self.max_duration = np.array(
+            [z.max_duration_hours if z.max_duration_hours is not None else np.inf for z in zones],
+            dtype=np.float64
+        )
+
+        # Average occupancy rate (0-100) per zone and hour-of-week
+        occupancy = np.full((n, HOURS_PER_WEEK), np.nan)
+        index = {zone_id: i for i, zone_id in enumerate(self.ids.tolist())}
+        for zone_id, day_of_week, hour_of_day, avg_rate in occupancy_rows:
+            if zone_id in index and day_of_week is not None and hour_of_day is not None:
+                occupancy[index[zone_id], day_of_week * 24 + hour_of_day] = avg_rate
+
+        # Buckets without history fall back to the zone mean, then the global mean
+        with warnings.catch_warnings():
+            # Zones without any history produce "Mean of empty slice"
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            zone_mean = np.nanmean(occupancy, axis=1)
+            global_mean = np.nanmean(zone_mean) if n else np.nan
+        if np.isnan(global_mean):
+            global_mean = 50.0
+        zone_mean = np.where(np.isnan(zone_mean), global_mean, zone_mean)
+        occupancy = np.where(np.isnan(occupancy), zone_mean[:, None], occupancy)
+
+        self.expected_free = self.total_spaces[:, None] * (1.0 - occupancy / 100.0)
+        self.built_at = time.time()
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def load_zone_features(db: Session) -> ZoneFeatures:
+    """Build feature arrays from active zones and their usage history"""
+    zones = db.query(ParkingZone).filter(
+        ParkingZone.is_active == True,
+        ParkingZone.latitude.isnot(None),
+        ParkingZone.longitude.isnot(None)
+    ).order_by(ParkingZone.id).all()
+
+    occupancy_rows = db.query(
+        ParkingUsage.zone_id,
+        ParkingUsage.day_of_week,
+        ParkingUsage.hour_of_day,
+        func.avg(ParkingUsage.occupancy_rate)
+    ).group_by(
+        ParkingUsage.zone_id, ParkingUsage.day_of_week, ParkingUsage.hour_of_day
+    ).all()
+
+    return ZoneFeatures(zones, occupancy_rows)
+
+
+class RecommendationEngine:
+    """Holds the current ZoneFeatures, rebuilt by the scheduler"""
+
+    def __init__(self, session_factory: Callable[[], Session]):
+        self.session_factory = session_factory
+        self._features: Optional[ZoneFeatures] = None
+        self._load_lock = threading.Lock()
+
+    def refresh(self, db: Optional[Session] = None) -> ZoneFeatures:
+        """Rebuild the feature arrays synchronously"""
+        own_session = db is None
+        if own_session:
+            db = self.session_factory()
+        try:
+            features = load_zone_features(db)
+        finally:
+            if own_session:
+                db.close()
+        self._features = features
+        return features
+
+    def features(self, db: Session) -> ZoneFeatures:
+        """Get current features, loading them on first use"""
+        features = self._features
+        if features is not None:
+            return features
+        with self._load_lock:
+            return self._features or self.refresh(db)
+
+    def recommend(
+        self,
+        db: Session,
+        lat: float,
+        lng: float,
+        arrival: datetime,
+        duration_hours: float,
+        max_walk_m: float,
+        limit: int
+    ) -> List[dict]:
+        """Score every zone and return the best `limit` candidates"""
+        f = self.features(db)
+        if not len(f):
+            return []
+
+        # Haversine distance to every zone, stretched to approximate walking
+        lat0, lng0 = np.radians(lat), np.radians(lng)
+        a = (np.sin((f.lat_rad - lat0) / 2) ** 2
+             + np.cos(lat0) * np.cos(f.lat_rad) * np.sin((f.lng_rad - lng0) / 2) ** 2)
+        distance = 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(a)) * WALK_DETOUR_FACTOR
+
+        if arrival.tzinfo is not None:
+            # Readings are stored in the server's local time
+            arrival = arrival.astimezone().replace(tzinfo=None)
+        free = f.expected_free[:, arrival.weekday() * 24 + arrival.hour]
+        cost = f.hourly_rate * duration_hours
+
+        eligible = (distance <= max_walk_m) & (f.max_duration >= duration_hours) & (free >= 1.0)
+        candidates = np.flatnonzero(eligible)
+        if not len(candidates):
+            return []
+
+        max_cost = cost[candidates].max()
+        score = (
+            AVAILABILITY_WEIGHT * (1.0 - np.exp(-free / AVAILABILITY_SCALE))
+            + DISTANCE_WEIGHT * (1.0 - distance / max_walk_m)
+            + COST_WEIGHT * ((1.0 - cost / max_cost) if max_cost > 0 else 1.0)
+        )
+
+        # Top-k without sorting every candidate
+        candidate_scores = score[candidates]
+        if len(candidates) > limit:
+            top = np.argpartition(-candidate_scores, limit - 1)[:limit]
+            candidates, candidate_scores = candidates[top], candidate_scores[top]
+        ranked = candidates[np.argsort(-candidate_scores, kind="stable")]
+
+        return [
+            {
+                "zone_id": int(f.ids[i]),
+                "zone_name": f.names[i],
+                "zone_code": f.codes[i],
+                "latitude": float(f.lat[i]),
+                "longitude": float(f.lng[i]),
+                "walking_distance_m": round(float(distance[i])),
+                "walking_minutes": round(float(distance[i]) / WALK_SPEED_M_PER_MIN, 1),
+                "expected_free_spaces": round(float(free[i]), 1),
+                "total_spaces": int(f.total_spaces[i]),
+                "hourly_rate": float(f.hourly_rate[i]),
+                "total_cost": round(float(cost[i]), 2),
+                "max_duration_hours": None if np.isinf(f.max_duration[i]) else int(f.max_duration[i]),
+                "score": round(float(score[i]), 4)
+            }
+            for i in ranked
+        ]
+
+
+# Per-region engines used by the API
+recommendation_engines = RegionLocal(lambda shard: RecommendationEngine(shard.SessionLocal))
@@ -0,0 +1,69 @@
+# services/regions.py
+"""
+Request routing and fan-out across region shards.
+
+`/api/regions/{region}/<path>` is served by the same endpoint as
+`/api/<path>`, with `region` as the current region so sessions, caches and
+background work use that region's shard. `fan_out()` runs a query on every
+shard concurrently for cross-region views.
+"""
+import asyncio
+import json
+import re
+from typing import Callable, Dict, List, Optional, TypeVar
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from database.regions import current_region, router, run_in_region
+
+T = TypeVar("T")
+
+REGION_PATH = re.compile(r"^/api/regions/(?P<region>[a-z0-9][a-z0-9-]*)(?P<rest>/.+)$")
+
+
+class RegionRoutingMiddleware:
+    """ASGI middleware mapping /api/regions/{region}/... onto the /api/... routes"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        match = REGION_PATH.match(scope["path"]) if scope["type"] == "http" else None
+        if match is None:
+            await self.app(scope, receive, send)
+            return
+
+        region = match["region"]
+        if region not in router:
+            body = json.dumps({"detail": f"Unknown region: {region}"}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 404,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode())]
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        path = "/api" + match["rest"]
+        scope = dict(scope, path=path, raw_path=path.encode())
+        token = current_region.set(region)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_region.reset(token)
+
+
+async def fan_out(fn: Callable[[Session], T], regions: Optional[List[str]] = None) -> Dict[str, object]:
+    """Run fn(db) on every region's shard concurrently.
+
+    Returns region -> result, or the exception a shard raised, so one
+    failing shard doesn't fail a cross-region view.
+    """
+    regions = regions or router.regions()
+    results = await asyncio.gather(
+        *(run_in_threadpool(run_in_region, region, fn) for region in regions),
+        return_exceptions=True
+    )
+    return dict(zip(regions, results))
@@ -0,0 +1,255 @@
+# services/scheduler.py
+"""
+In-app background job scheduler tied to the FastAPI lifespan.
+
+Each registered job gets its own asyncio loop that sleeps for its interval
+(with +/- jitter so workers don't fire in lockstep) or until one of its
+trigger events is notified, then runs the job in a thread pool. A job's
+loop awaits the run before scheduling the next one, so a job never
+overlaps with itself.
+
+Jobs marked leader_only run on a single worker: workers compete for a
+lease row in scheduler_locks and only the current holder runs them. The
+lease is renewed on its own thread, so long jobs can't delay renewal, and
+is re-checked (against the local clock) before each leader-only run.
+"""
+import asyncio
+import os
+import random
+import socket
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import delete, insert, or_, update
+from sqlalchemy.exc import IntegrityError
+
+from database.models import engine, SchedulerLock
+from database.query_log import query_source
+
+LEADER_LOCK_NAME = "scheduler"
+LEASE_SECONDS = 30
+MAX_JOB_THREADS = 4
+
+
+class Job:
+    """A periodic and/or event-triggered unit of background work"""
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[], object],
+        interval: Optional[float] = None,
+        triggers: Optional[List[str]] = None,
+        jitter: float = 0.1,
+        debounce: float = 2.0,
+        run_on_start: bool = False,
+        leader_only: bool = False
+    ):
+        self.name = name
+        self.fn = fn
+        self.interval = interval  # Seconds; None for trigger/start-only jobs
+        self.triggers = triggers or []
+        self.jitter = jitter  # Fraction of the interval
+        self.debounce = debounce  # Seconds to wait after a trigger to batch changes
+        self.run_on_start = run_on_start
+        self.leader_only = leader_only
+
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.running = False
+        self.last_started: Optional[datetime] = None
+        self.last_duration_ms: Optional[float] = None
+        self.last_lag_ms: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.next_run: Optional[datetime] = None
+        self._event: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def status(self) -> dict:
+        return {
+            "name": self.name,
+            "interval_seconds": self.interval,
+            "triggers": self.triggers,
+            "leader_only": self.leader_only,
+            "running": self.running,
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "last_started": self.last_started.isoformat() if self.last_started else None,
+            "last_duration_ms": self.last_duration_ms,
+            "last_lag_ms": self.last_lag_ms,
+            "last_error": self.last_error,
+            "next_run": self.next_run.isoformat() if self.next_run else None
+        }
+
+
+class Scheduler:
+    """Runs registered jobs for as long as the app is up"""
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+        self.jobs: Dict[str, Job] = {}
+        self.is_leader = False
+        self._lease_expires = 0.0  # time.monotonic() deadline of our lease
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lease_executor: Optional[ThreadPoolExecutor] = None
+        self._lease_task: Optional[asyncio.Task] = None
+
+    def add(self, job: Job):
+        """Register a job (replaces a job with the same name)"""
+        self.jobs[job.name] = job
+
+    def notify(self, event: str):
+        """Trigger jobs subscribed to an event; safe to call from any thread"""
+        if self._loop is None:
+            return
+        for job in self.jobs.values():
+            if event in job.triggers and job._event is not None:
+                self._loop.call_soon_threadsafe(job._event.set)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._executor = ThreadPoolExecutor(max_workers=MAX_JOB_THREADS, thread_name_prefix="job")
+        self._lease_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lease")
+
+        await self._renew_lease()
+        self._lease_task = asyncio.create_task(self._lease_loop())
+
+        for job in self.jobs.values():
+            job._event = asyncio.Event()
+            job._task = asyncio.create_task(self._job_loop(job))
+
+    async def stop(self):
+        tasks = [job._task for job in self.jobs.values() if job._task] + [self._lease_task]
+        for task in tasks:
+            if task:
+                task.cancel()
+        await asyncio.gather(*[t for t in tasks if t], return_exceptions=True)
+
+        if self.is_leader:
+            await self._loop.run_in_executor(self._lease_executor, self._release_lease)
+            self.is_leader = False
+        self._executor.shutdown(wait=False)
+        self._lease_executor.shutdown(wait=False)
+        self._loop = None
+
+    # Leader lease
+
+    def _acquire_lease(self) -> bool:
+        now = datetime.utcnow()
+        expires = now + timedelta(seconds=LEASE_SECONDS)
+        with engine.begin() as conn:
+            renewed = conn.execute(
+                update(SchedulerLock).where(
+                    SchedulerLock.name == LEADER_LOCK_NAME,
+                    or_(SchedulerLock.owner == self.worker_id, SchedulerLock.expires_at < now)
+                ).values(owner=self.worker_id, expires_at=expires)
+            )
+            if renewed.rowcount:
+                return True
+        try:
+            with engine.begin() as conn:
+                conn.execute(insert(SchedulerLock).values(
+                    name=LEADER_LOCK_NAME, owner=self.worker_id, expires_at=expires
+                ))
+            return True
+        except IntegrityError:
+            # Another worker holds a live lease
+            return False
+
+    def _release_lease(self):
+        with engine.begin() as conn:
+            conn.execute(delete(SchedulerLock).where(
+                SchedulerLock.name == LEADER_LOCK_NAME,
+                SchedulerLock.owner == self.worker_id
+            ))
+
+    async def _renew_lease(self):
+        # The lease is measured from before the attempt, so our deadline is never later than the row's
+        attempted = time.monotonic()
+        try:
+            self.is_leader = await self._loop.run_in_executor(self._lease_executor, self._acquire_lease)
+        except Exception as e:
+            print(f"Scheduler lease error: {e}")
+            self.is_leader = False
+        if self.is_leader:
+            self._lease_expires = attempted + LEASE_SECONDS
+
+    def holds_lease(self) -> bool:
+        """True while this worker's lease has not expired"""
+        return self.is_leader and time.monotonic() < self._lease_expires
+
+    async def _lease_loop(self):
+        while True:
+            await asyncio.sleep(LEASE_SECONDS / 3)
+            await self._renew_lease()
+
+    # Job execution
+
+    async def _job_loop(self, job: Job):
+        if job.run_on_start:
+            await self._run(job, scheduled=time.time())
+
+        while True:
+            delay = None
+            if job.interval is not None:
+                delay = job.interval * (1 + random.uniform(-job.jitter, job.jitter))
+                job.next_run = datetime.now() + timedelta(seconds=delay)
+            scheduled = time.time() + (delay or 0)
+
+            try:
+                await asyncio.wait_for(job._event.wait(), delay)
+                # Triggered: wait a little so a burst of changes runs the job once
+                scheduled = time.time() + job.debounce
+                await asyncio.sleep(job.debounce)
+            except asyncio.TimeoutError:
+                pass
+            job._event.clear()
+
+            await self._run(job, scheduled)
+
+    @staticmethod
+    def _call(job: Job):
+        # Label the job's queries in the slow-query log
+        token = query_source.set(f"job:{job.name}")
+        try:
+            job.fn()
+        finally:
+            query_source.reset(token)
+
+    async def _run(self, job: Job, scheduled: float):
+        if job.leader_only and not self.holds_lease():
+            job.skipped += 1
+            return
+
+        started = time.time()
+        job.running = True
+        job.last_started = datetime.now()
+        job.last_lag_ms = round(max(0.0, started - scheduled) * 1000, 1)
+        try:
+            await self._loop.run_in_executor(self._executor, self._call, job)
+            job.last_error = None
+        except Exception as e:
+            job.failures += 1
+            job.last_error = str(e)
+            print(f"Job {job.name} failed: {e}")
+        finally:
+            job.runs += 1
+            job.running = False
+            job.last_duration_ms = round((time.time() - started) * 1000, 1)
+
+    def status(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "is_leader": self.holds_lease(),
+            "jobs": [job.status() for job in self.jobs.values()]
+        }
+
+
+# Shared scheduler started by the app lifespan
+scheduler = Scheduler()
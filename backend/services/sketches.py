@@ -0,0 +1,314 @@
+# services/sketches.py
+"""
+Mergeable occupancy distribution sketches per zone and hour-of-week.
+
+A sketch is a histogram of occupancy rates in RESOLUTION-wide bins over the
+fixed 0-100% range (bin 0 holds exactly 0%, bin i holds rates in
+((i-1) * RESOLUTION, i * RESOLUTION]) for each of the 168 hours of the week.
+Histograms over a fixed range merge exactly by adding counts, so quantiles
+are accurate to within RESOLUTION percentage points however many readings
+they cover.
+
+Each zone keeps one sketch per day, per month and per year, each holding
+only the non-empty (hour_of_week, bin) cells (6 bytes each). A window is
+split into whole years, then whole months, then days at its edges, so a
+query merges a bounded number of pre-merged sketches (about 90 for ten
+years) rather than one per hour. Windows are whole days.
+
+All three levels are updated on ingest in the reading's transaction.
+`verify()` compares per-zone counts and bin sums with parking_usage, so
+readings written some other way, deleted or changed are detected, and
+rebuilds those zones. Readings without a rate or outside 0-100% (flagged
+invalid by the anomaly detector) are not counted.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Integer, and_, case, cast, delete, func, insert, or_, select
+from sqlalchemy.orm import Session
+
+from database.models import ParkingUsage, OccupancySketch
+
+RESOLUTION = 0.5  # Percentage points per bin
+BINS = int(100 / RESOLUTION) + 1
+QUANTILES = (0.5, 0.9, 0.99)
+FULL_THRESHOLD = 95.0  # "Full" means occupancy strictly above this
+HOURS_PER_WEEK = 168
+LEVELS = ("day", "month", "year")
+REBUILD_BATCH = 100_000  # Readings per read-only query
+
+CELL = np.dtype([("hour", "u1"), ("bin", "u1"), ("count", "<u4")])
+
+# NumPy units of each level's periods
+LEVEL_UNITS = {"day": "D", "month": "M", "year": "Y"}
+
+
+def to_bin(rate: float) -> int:
+    return int(np.ceil(rate / RESOLUTION))
+
+
+def hour_of_week(ts: datetime) -> int:
+    return ts.weekday() * 24 + ts.hour
+
+
+def period_start(ts: datetime, level: str) -> datetime:
+    day = ts.replace(hour=0, minute=0, second=0, microsecond=0)
+    if level == "day":
+        return day
+    if level == "month":
+        return day.replace(day=1)
+    return day.replace(month=1, day=1)
+
+
+def countable(rate: Optional[float]) -> bool:
+    return rate is not None and 0.0 <= rate <= 100.0
+
+
+def _add_cell(blob: bytes, hour: int, bin_index: int) -> bytes:
+    cells = np.frombuffer(blob, dtype=CELL)
+    hit = np.flatnonzero((cells["hour"] == hour) & (cells["bin"] == bin_index))
+    if not len(hit):
+        return blob + np.array([(hour, bin_index, 1)], dtype=CELL).tobytes()
+    cells = cells.copy()
+    cells["count"][hit[0]] += 1
+    return cells.tobytes()
+
+
+def add_reading(db: Session, zone_id: int, timestamp: datetime, occupancy_rate: Optional[float]):
+    """Count a reading in its zone's day, month and year sketches; call within the reading's transaction"""
+    if not countable(occupancy_rate):
+        return
+    hour, bin_index = hour_of_week(timestamp), to_bin(occupancy_rate)
+    starts = {level: period_start(timestamp, level) for level in LEVELS}
+    existing = {
+        sketch.level: sketch
+        for sketch in db.query(OccupancySketch).filter(
+            OccupancySketch.zone_id == zone_id,
+            or_(*(and_(OccupancySketch.level == level, OccupancySketch.period_start == start)
+                  for level, start in starts.items()))
+        )
+    }
+
+    for level, start in starts.items():
+        sketch = existing.get(level)
+        if sketch is None:
+            sketch = OccupancySketch(
+                zone_id=zone_id, level=level, period_start=start, count=0, bin_sum=0, cells=b""
+            )
+            db.add(sketch)
+        sketch.cells = _add_cell(sketch.cells, hour, bin_index)
+        sketch.count += 1
+        sketch.bin_sum += bin_index
+
+
+def _quantiles(hist: np.ndarray) -> Dict[str, Optional[float]]:
+    """Quantiles interpolated linearly within the bin they fall in"""
+    total = int(hist.sum())
+    result = {}
+    cumulative = np.cumsum(hist)
+    for q in QUANTILES:
+        key = f"p{round(q * 100)}"
+        if not total:
+            result[key] = None
+            continue
+        target = q * total
+        index = int(np.searchsorted(cumulative, target, side="left"))
+        if index == 0:
+            result[key] = 0.0
+            continue
+        below = cumulative[index - 1]
+        lower = (index - 1) * RESOLUTION
+        result[key] = round(lower + (target - below) / hist[index] * RESOLUTION, 2)
+    return result
+
+
+def summarize(hist: np.ndarray) -> dict:
+    total = int(hist.sum())
+    full = int(hist[int(FULL_THRESHOLD / RESOLUTION) + 1:].sum())
+    return dict(
+        {"count": total},
+        **_quantiles(hist),
+        fraction_over_95=round(full / total, 4) if total else None
+    )
+
+
+def _next_period(start: datetime, level: str) -> datetime:
+    if level == "day":
+        return start + timedelta(days=1)
+    if level == "month":
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    return start.replace(year=start.year + 1)
+
+
+def window_periods(since: datetime, until: datetime) -> Dict[str, List[datetime]]:
+    """Split [since's day, until's day) into whole years, then months, then days"""
+    periods: Dict[str, List[datetime]] = {level: [] for level in LEVELS}
+    current, end = period_start(since, "day"), period_start(until, "day")
+    while current < end:
+        for level in reversed(LEVELS):
+            if period_start(current, level) != current:
+                continue
+            following = _next_period(current, level)
+            if following <= end:
+                periods[level].append(current)
+                current = following
+                break
+    return periods
+
+
+def distribution(db: Session, zone_id: int, since: datetime, until: Optional[datetime] = None) -> dict:
+    """Merge a zone's sketches over the days from since up to and including until's day"""
+    until = until or datetime.now()
+    periods = window_periods(since, period_start(until, "day") + timedelta(days=1))
+    query = select(OccupancySketch.cells).where(
+        OccupancySketch.zone_id == zone_id,
+        or_(*(and_(OccupancySketch.level == level, OccupancySketch.period_start.in_(starts))
+              for level, starts in periods.items() if starts))
+    )
+
+    hours, bins, counts = [], [], []
+    sketches = 0
+    for (blob,) in db.execute(query) if any(periods.values()) else ():
+        cells = np.frombuffer(blob, dtype=CELL)
+        hours.append(cells["hour"])
+        bins.append(cells["bin"])
+        counts.append(cells["count"])
+        sketches += 1
+
+    by_hour = np.zeros((HOURS_PER_WEEK, BINS), dtype=np.int64)
+    if sketches:
+        np.add.at(by_hour, (np.concatenate(hours), np.concatenate(bins)), np.concatenate(counts))
+
+    return {
+        "sketches_merged": sketches,
+        "overall": summarize(by_hour.sum(axis=0)),
+        "hours_of_week": [
+            dict({"hour_of_week": how, "day_of_week": how // 24, "hour": how % 24}, **summarize(by_hour[how]))
+            for how in range(HOURS_PER_WEEK) if by_hour[how].any()
+        ]
+    }
+
+
+def _valid_rates():
+    return ParkingUsage.occupancy_rate.between(0.0, 100.0)
+
+
+def _usage_rows(zone_ids: Optional[List[int]]):
+    rows = select(ParkingUsage.zone_id, ParkingUsage.timestamp, ParkingUsage.occupancy_rate).where(_valid_rates())
+    if zone_ids is not None:
+        rows = rows.where(ParkingUsage.zone_id.in_(zone_ids))
+    return rows
+
+
+def _merge(keys: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sum the counts of equal keys (or key rows), returning the keys sorted"""
+    keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+    return keys, np.bincount(inverse.ravel(), weights=counts, minlength=len(keys)).astype(np.int64)
+
+
+def _bin_counts(rows) -> Tuple[np.ndarray, np.ndarray]:
+    """Reading counts per (zone, clock hour * BINS + bin)"""
+    zone_ids, timestamps, rates = zip(*rows)
+    hours = np.array(timestamps, dtype="datetime64[h]").astype(np.int64)
+    bins = np.ceil(np.asarray(rates, dtype=np.float64) / RESOLUTION).astype(np.int64)
+    return _merge(np.column_stack([zone_ids, hours * BINS + bins]), np.ones(len(rows)))
+
+
+def _zone_sketches(zone_id: int, keys: np.ndarray, counts: np.ndarray) -> List[dict]:
+    """Sketch rows of every level from one zone's clock hour * BINS + bin keys and their counts"""
+    if not len(keys):
+        return []
+    clock_hours = (keys // BINS).astype("datetime64[h]")
+    bins = keys % BINS
+    days = clock_hours.astype("datetime64[D]")
+    # 1970-01-01 was a Thursday (weekday 3)
+    hours = ((days.astype(np.int64) + 3) % 7) * 24 + (clock_hours - days).astype(np.int64)
+
+    sketches = []
+    for level in LEVELS:
+        periods = days.astype(f"datetime64[{LEVEL_UNITS[level]}]").astype("datetime64[D]").astype(np.int64)
+        cell_keys, cell_counts = _merge(np.column_stack([periods, hours, bins]), counts)
+        bounds = np.flatnonzero(np.diff(cell_keys[:, 0])) + 1
+        for group, group_counts in zip(np.split(cell_keys, bounds), np.split(cell_counts, bounds)):
+            cells = np.empty(len(group), dtype=CELL)
+            cells["hour"] = group[:, 1]
+            cells["bin"] = group[:, 2]
+            cells["count"] = group_counts
+            sketches.append({
+                "zone_id": zone_id, "level": level,
+                "period_start": np.datetime64(int(group[0, 0]), "D").astype("datetime64[us]").item(),
+                "count": int(group_counts.sum()),
+                "bin_sum": int((group[:, 2] * group_counts).sum()),
+                "cells": cells.tobytes()
+            })
+    return sketches
+
+
+def rebuild(db: Session, zone_ids: Optional[Iterable[int]] = None):
+    """Recompute sketches from parking_usage (all zones, or the given ones)
+
+    Readings are counted in a read-only pass over short id ranges, so ingests
+    keep committing meanwhile. Each zone's sketches are then swapped in its
+    own short transaction, which also counts readings added since the pass.
+    """
+    zone_ids = None if zone_ids is None else list(zone_ids)
+    read_up_to = db.scalar(select(func.max(ParkingUsage.id))) or 0
+
+    keys, counts = np.empty((0, 2), dtype=np.int64), np.empty(0, dtype=np.int64)
+    for after in range(0, read_up_to, REBUILD_BATCH):
+        rows = db.execute(_usage_rows(zone_ids).where(
+            ParkingUsage.id > after, ParkingUsage.id <= min(after + REBUILD_BATCH, read_up_to)
+        )).all()
+        if rows:
+            batch_keys, batch_counts = _bin_counts(rows)
+            keys, counts = _merge(np.concatenate([keys, batch_keys]), np.concatenate([counts, batch_counts]))
+    db.rollback()
+
+    if zone_ids is None:
+        zone_ids = sorted(set(keys[:, 0].tolist()) | set(db.scalars(select(OccupancySketch.zone_id).distinct())))
+    for zone_id in zone_ids:
+        in_zone = keys[:, 0] == zone_id
+        zone_keys, zone_counts = keys[in_zone, 1], counts[in_zone]
+        rows = _zone_sketches(zone_id, zone_keys, zone_counts)
+
+        # The delete takes the write lock, so no reading can slip in before the insert
+        db.execute(delete(OccupancySketch).where(OccupancySketch.zone_id == zone_id))
+        late = db.execute(_usage_rows([zone_id]).where(ParkingUsage.id > read_up_to)).all()
+        if late:
+            late_keys, late_counts = _bin_counts(late)
+            merged_keys, merged_counts = _merge(np.concatenate([zone_keys, late_keys[:, 1]]),
+                                                np.concatenate([zone_counts, late_counts]))
+            rows = _zone_sketches(zone_id, merged_keys, merged_counts)
+        if rows:
+            db.connection().execute(insert(OccupancySketch.__table__), rows)
+        db.commit()
+
+
+def verify(db: Session) -> dict:
+    """Rebuild zones whose sketch counts or bin sums (at any level) differ from their valid readings"""
+    scaled = ParkingUsage.occupancy_rate / RESOLUTION
+    reading_bin = cast(scaled, Integer) + case((scaled > cast(scaled, Integer), 1), else_=0)  # ceil()
+    expected = {
+        zone_id: (count, bin_sum or 0)
+        for zone_id, count, bin_sum in db.execute(
+            select(ParkingUsage.zone_id, func.count(), func.sum(reading_bin))
+            .where(_valid_rates()).group_by(ParkingUsage.zone_id)
+        )
+    }
+    actual: Dict[int, Dict[str, tuple]] = {}
+    for zone_id, level, count, bin_sum in db.execute(
+        select(OccupancySketch.zone_id, OccupancySketch.level,
+               func.sum(OccupancySketch.count), func.sum(OccupancySketch.bin_sum))
+        .group_by(OccupancySketch.zone_id, OccupancySketch.level)
+    ):
+        actual.setdefault(zone_id, {})[level] = (count, bin_sum)
+
+    zones = set(expected) | set(actual)
+    mismatched = sorted(
+        zone_id for zone_id in zones
+        if any(actual.get(zone_id, {}).get(level, (0, 0)) != expected.get(zone_id, (0, 0)) for level in LEVELS)
+    )
+    if mismatched:
+        rebuild(db, mismatched)
+    return {"zones_checked": len(zones), "rebuilt_zones": mismatched}
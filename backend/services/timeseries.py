@@ -0,0 +1,365 @@
+# services/timeseries.py
+"""
+In-process ring buffers of recent parking occupancy per zone.
+
+Each zone holds the newest SAMPLES_PER_ZONE usage rows in fixed-size NumPy
+arrays (one per column), so recent-window endpoints are answered without
+SQL or ORM objects. Memory is allocated once per zone:
+
+    id (int64) + timestamp (int64 us) + occupancy_rate (float64)
+    + occupied_spaces (int32) + total_spaces (int32) + flagged (bool)
+    = 33 bytes per sample, i.e. 33 * SAMPLES_PER_ZONE bytes (~22 KB) per zone
+
+The buffers are filled from the database at startup and are read without
+SQL. `catch_up()` appends rows with ids above the newest one seen, whichever
+worker or script wrote them; it runs after each ingest on this worker and
+every CATCH_UP_SECONDS (with a zone metadata refresh) from a scheduler job,
+so rows and zone edits from elsewhere show up within that interval.
+Invariant: a zone's buffer equals the newest SAMPLES_PER_ZONE rows of that
+zone in parking_usage, which `verify()` checks against the database (it
+also catches updates and deletes, which catch-up does not see).
+Time-window queries are only answered when every zone's buffer reaches back
+to the window start (`covers()`); callers fall back to SQL otherwise.
+"""
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from database.models import ParkingZone, ParkingUsage, AnomalyFlag
+from database.regions import RegionLocal
+
+RETENTION_DAYS = 7
+SAMPLES_PER_HOUR = 4  # Expected reading cadence (15 minutes)
+SAMPLES_PER_ZONE = RETENTION_DAYS * 24 * SAMPLES_PER_HOUR
+CATCH_UP_SECONDS = 10
+
+COLUMNS = (
+    ("ids", np.int64),
+    ("timestamps", np.int64),
+    ("occupancy", np.float64),
+    ("occupied", np.int32),
+    ("total", np.int32),
+    ("flagged", np.bool_),
+)
+BYTES_PER_SAMPLE = sum(np.dtype(dtype).itemsize for _, dtype in COLUMNS)
+
+
+def to_micros(ts: datetime) -> int:
+    return int(np.datetime64(ts, "us").astype(np.int64))
+
+
+def from_micros(values: np.ndarray) -> List[datetime]:
+    return values.astype("datetime64[us]").tolist()
+
+
+def nan_to_none(values: np.ndarray) -> List[Optional[float]]:
+    """Readings without a rate are stored as NaN, which JSON can't carry"""
+    return [None if np.isnan(v) else v for v in values.tolist()]
+
+
+class _ZoneBuffer:
+    """Fixed-capacity ring of one zone's newest samples"""
+
+    __slots__ = ("capacity", "head", "count", "newest", "in_order") + tuple(name for name, _ in COLUMNS)
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.head = 0  # Next slot to write while samples arrive in order
+        self.count = 0
+        self.newest: Optional[int] = None
+        self.in_order = True  # Slots are chronological starting at head
+        for name, dtype in COLUMNS:
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+
+    def append(self, reading_id: int, ts: int, occupancy: float, occupied: int, total: int, flagged: bool):
+        if self.count < self.capacity:
+            slot = self.count
+        else:
+            # Full: replace the oldest sample, unless this one is older still
+            slot = self.head if self.in_order else int(np.argmin(self.timestamps))
+            if ts < self.timestamps[slot]:
+                return
+        if self.newest is not None and ts < self.newest:
+            self.in_order = False
+
+        self.ids[slot] = reading_id
+        self.timestamps[slot] = ts
+        self.occupancy[slot] = np.nan if occupancy is None else occupancy
+        self.occupied[slot] = occupied
+        self.total[slot] = total
+        self.flagged[slot] = flagged
+        self.head = (slot + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.newest = ts if self.newest is None else max(self.newest, ts)
+
+    def order(self) -> np.ndarray:
+        """Slot indexes from oldest to newest sample"""
+        if self.count < self.capacity:
+            idx = np.arange(self.count)
+        else:
+            idx = (self.head + np.arange(self.capacity)) % self.capacity
+        if not self.in_order:
+            idx = idx[np.argsort(self.timestamps[idx], kind="stable")]
+        return idx
+
+    def complete(self) -> bool:
+        """True when the buffer holds every row the zone has"""
+        return self.count < self.capacity
+
+    def oldest(self) -> Optional[int]:
+        if not self.count:
+            return None
+        return int(self.timestamps[:self.count].min())
+
+
+class OccupancyStore:
+    """Per-zone ring buffers plus zone metadata"""
+
+    def __init__(self, capacity: int = SAMPLES_PER_ZONE):
+        self.capacity = capacity
+        self.loaded = False
+        self.last_id = 0  # Highest parking_usage id in the buffers
+        self._lock = threading.RLock()
+        self._buffers: Dict[int, _ZoneBuffer] = {}
+        self._zones: Dict[int, dict] = {}
+
+    @staticmethod
+    def _zone_info(zone) -> dict:
+        return {
+            "id": zone.id,
+            "zone_name": zone.zone_name,
+            "zone_code": zone.zone_code,
+            "latitude": zone.latitude,
+            "longitude": zone.longitude,
+            "total_spaces": zone.total_spaces,
+            "hourly_rate": zone.hourly_rate,
+            "max_duration_hours": zone.max_duration_hours,
+        }
+
+    def _newest_rows(self, db: Session, up_to_id: Optional[int] = None):
+        """Newest `capacity` usage rows per zone, oldest first"""
+        rank = func.row_number().over(
+            partition_by=ParkingUsage.zone_id,
+            order_by=(ParkingUsage.timestamp.desc(), ParkingUsage.id.desc())
+        ).label("rank")
+        ranked = select(
+            ParkingUsage.id, ParkingUsage.zone_id, ParkingUsage.timestamp,
+            ParkingUsage.occupancy_rate, ParkingUsage.occupied_spaces,
+            ParkingUsage.total_spaces, rank
+        )
+        if up_to_id is not None:
+            ranked = ranked.where(ParkingUsage.id <= up_to_id)
+        ranked = ranked.subquery()
+        flagged = select(AnomalyFlag.reading_id).where(AnomalyFlag.source == "parking_usage")
+
+        return db.execute(
+            select(
+                ranked.c.id, ranked.c.zone_id, ranked.c.timestamp, ranked.c.occupancy_rate,
+                ranked.c.occupied_spaces, ranked.c.total_spaces,
+                ranked.c.id.in_(flagged)
+            ).where(ranked.c.rank <= self.capacity).order_by(
+                ranked.c.zone_id, ranked.c.timestamp, ranked.c.id
+            )
+        )
+
+    def load(self, db: Session):
+        """(Re)build every buffer from the database"""
+        last_id = db.scalar(select(func.max(ParkingUsage.id))) or 0
+        zones = {zone.id: self._zone_info(zone) for zone in db.query(ParkingZone).all()}
+        buffers = {zone_id: _ZoneBuffer(self.capacity) for zone_id in zones}
+
+        # Rows above last_id are left to catch_up() so none is appended twice
+        for reading_id, zone_id, ts, occupancy, occupied, total, flagged in self._newest_rows(db, last_id):
+            if zone_id in buffers:
+                buffers[zone_id].append(reading_id, to_micros(ts), occupancy, occupied, total, bool(flagged))
+
+        with self._lock:
+            self._zones = zones
+            self._buffers = buffers
+            self.last_id = last_id
+            self.loaded = True
+        self.catch_up(db)
+
+    def refresh_zones(self, db: Session):
+        """Reload zone metadata, dropping the buffers of deleted zones"""
+        if not self.loaded:
+            return
+        zones = {zone.id: self._zone_info(zone) for zone in db.query(ParkingZone).all()}
+        with self._lock:
+            self._zones = zones
+            for zone_id in set(self._buffers) - set(zones):
+                del self._buffers[zone_id]
+            for zone_id in set(zones) - set(self._buffers):
+                self._buffers[zone_id] = _ZoneBuffer(self.capacity)
+
+    def catch_up(self, db: Session) -> int:
+        """Append rows committed since the load or last catch-up; returns rows added"""
+        if not self.loaded:
+            return 0
+        after = self.last_id
+        rows = db.execute(select(
+            ParkingUsage.id, ParkingUsage.zone_id, ParkingUsage.timestamp, ParkingUsage.occupancy_rate,
+            ParkingUsage.occupied_spaces, ParkingUsage.total_spaces
+        ).where(ParkingUsage.id > after).order_by(ParkingUsage.id)).all()
+        if not rows:
+            return 0
+        flagged = set(db.scalars(select(AnomalyFlag.reading_id).where(
+            AnomalyFlag.source == "parking_usage", AnomalyFlag.reading_id > after
+        )))
+        if any(zone_id not in self._zones for _, zone_id, *_ in rows):
+            self.refresh_zones(db)
+
+        added = 0
+        with self._lock:
+            for reading_id, zone_id, ts, occupancy, occupied, total in rows:
+                # A concurrent catch-up may have appended it already
+                if reading_id <= self.last_id:
+                    continue
+                self.last_id = reading_id
+                if zone_id in self._buffers:
+                    self._buffers[zone_id].append(
+                        reading_id, to_micros(ts), occupancy, occupied, total, reading_id in flagged
+                    )
+                    added += 1
+        return added
+
+    def covers(self, cutoff: datetime) -> bool:
+        """True if every zone's buffer reaches back to `cutoff`"""
+        if not self.loaded:
+            return False
+        cutoff_us = to_micros(cutoff)
+        with self._lock:
+            return all(
+                buffer.complete() or buffer.oldest() <= cutoff_us
+                for buffer in self._buffers.values()
+            )
+
+    def zone(self, zone_id: int) -> Optional[dict]:
+        return self._zones.get(zone_id) if self.loaded else None
+
+    def recent(self, zone_id: int, limit: int) -> Optional[List[dict]]:
+        """Newest `limit` samples of a zone, newest first; None if not answerable"""
+        with self._lock:
+            buffer = self._buffers.get(zone_id)
+            if not self.loaded or buffer is None or (buffer.count < limit and not buffer.complete()):
+                return None
+            idx = buffer.order()[::-1][:limit]
+            timestamps = from_micros(buffer.timestamps[idx])
+            occupancy = nan_to_none(buffer.occupancy[idx])
+            occupied = buffer.occupied[idx].tolist()
+
+        return [
+            {"timestamp": ts, "occupancy_rate": rate, "occupied_spaces": occ}
+            for ts, rate, occ in zip(timestamps, occupancy, occupied)
+        ]
+
+    def _window(self, cutoff: datetime, exclude_flagged: bool) -> Tuple[np.ndarray, ...]:
+        """Concatenated (zone_ids, timestamps, occupancy, occupied, total) since cutoff"""
+        cutoff_us = to_micros(cutoff)
+        parts = []
+        with self._lock:
+            for zone_id, buffer in self._buffers.items():
+                if not buffer.count:
+                    continue
+                idx = buffer.order()
+                keep = buffer.timestamps[idx] >= cutoff_us
+                if exclude_flagged:
+                    keep &= ~buffer.flagged[idx]
+                idx = idx[keep]
+                parts.append((
+                    np.full(len(idx), zone_id, dtype=np.int64),
+                    buffer.timestamps[idx], buffer.occupancy[idx],
+                    buffer.occupied[idx], buffer.total[idx]
+                ))
+        if not parts:
+            return tuple(np.empty(0) for _ in range(5))
+        return tuple(np.concatenate(column) for column in zip(*parts))
+
+    def latest(self, cutoff: datetime, limit: int, exclude_flagged: bool = False) -> List[dict]:
+        """Newest `limit` samples across all zones since cutoff, newest first"""
+        with self._lock:
+            zones = self._zones
+            zone_ids, timestamps, occupancy, occupied, total = self._window(cutoff, exclude_flagged)
+        if len(timestamps) > limit:
+            top = np.argpartition(-timestamps, limit - 1)[:limit]
+        else:
+            top = np.arange(len(timestamps))
+        top = top[np.argsort(-timestamps[top], kind="stable")]
+
+        return [
+            {
+                "timestamp": ts,
+                "zone_name": zones[zone_id]["zone_name"],
+                "occupied_spaces": occ,
+                "total_spaces": tot,
+                "occupancy_rate": rate
+            }
+            for ts, zone_id, occ, tot, rate in zip(
+                from_micros(timestamps[top].astype(np.int64)), zone_ids[top].tolist(),
+                occupied[top].tolist(), total[top].tolist(), nan_to_none(occupancy[top])
+            )
+        ]
+
+    def average(self, cutoff: datetime, exclude_flagged: bool = False) -> Optional[float]:
+        """Mean occupancy rate of all samples since cutoff"""
+        _, _, occupancy, _, _ = self._window(cutoff, exclude_flagged)
+        occupancy = occupancy[~np.isnan(occupancy)]
+        return float(occupancy.mean()) if len(occupancy) else None
+
+    def verify(self, db: Session) -> dict:
+        """Compare every buffer with the newest rows per zone in the database"""
+        expected: Dict[int, list] = {zone_id: [] for zone_id in db.scalars(select(ParkingZone.id))}
+        for row in self._newest_rows(db):
+            reading_id, zone_id, ts, occupancy, occupied, total, flagged = row
+            if zone_id not in expected:
+                continue  # Rows of deleted zones are not buffered
+            expected[zone_id].append(
+                (reading_id, to_micros(ts), occupancy, occupied, total, bool(flagged))
+            )
+
+        mismatched = []
+        with self._lock:
+            zone_ids = set(self._buffers) | set(expected)
+            for zone_id in zone_ids:
+                buffer = self._buffers.get(zone_id)
+                rows = expected.get(zone_id, [])
+                if buffer is None:
+                    if rows:
+                        mismatched.append(zone_id)
+                    continue
+                idx = buffer.order()
+                actual = list(zip(
+                    buffer.ids[idx].tolist(), buffer.timestamps[idx].tolist(),
+                    nan_to_none(buffer.occupancy[idx]),
+                    buffer.occupied[idx].tolist(), buffer.total[idx].tolist(),
+                    buffer.flagged[idx].tolist()
+                ))
+                if sorted(actual) != sorted(rows):
+                    mismatched.append(zone_id)
+
+        return {
+            "consistent": not mismatched,
+            "zones_checked": len(zone_ids),
+            "mismatched_zones": sorted(mismatched)
+        }
+
+    def stats(self) -> dict:
+        with self._lock:
+            samples = sum(buffer.count for buffer in self._buffers.values())
+            zones = len(self._buffers)
+        return {
+            "loaded": self.loaded,
+            "zones": zones,
+            "samples": samples,
+            "samples_per_zone": self.capacity,
+            "bytes_per_sample": BYTES_PER_SAMPLE,
+            "allocated_bytes": zones * self.capacity * BYTES_PER_SAMPLE
+        }
+
+
+# Per-region stores used by the API
+occupancy_stores = RegionLocal(lambda shard: OccupancyStore())